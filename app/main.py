@@ -1,58 +1,126 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+import hashlib
 import logging
 import os
-from app.utils.db import init_users_table, init_devices_table, init_telemetry_table, get_db_context
+import queue
+import time
+from app.utils.db import run_migrations, is_schema_migrated, get_db_context, get_pool_status, engine, async_engine, probe_engine, AsyncSessionLocal
 from app.utils.seeder import seed_database
+from app.utils.responses import APIJSONResponse
 from app.routes import auth, telemetry, devices, chat
+from app.utils.hashing import HASH_POOL
+from app.services.chat_service import llm_batcher, openai_http_client
+from app.services.telemetry_buffer import telemetry_buffer
+from app.utils.cache import redis_client
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging. Callers only enqueue records; a listener thread does
+# the formatting and writing, so handler locks and output I/O stay off the
+# request path
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler(), respect_handler_level=True)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)])
+_log_listener.start()
 logger = logging.getLogger(__name__)
 
-# Flag to track if database has been initialized
+# Advisory lock key that serializes database initialization across workers
+DB_INIT_LOCK_ID = 9173461
+# Waiting workers poll for the lock instead of blocking on it. A blocked
+# statement holds a snapshot, and CREATE INDEX CONCURRENTLY in the
+# migrations waits for every older snapshot, so a blocking wait would
+# deadlock against the worker running them
+DB_INIT_POLL_SECONDS = 1.0
+
+# Flag to track if database has been initialized (used when advisory locks
+# are not available, i.e. non-PostgreSQL databases)
 _db_initialized = False
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+def _initialize_database():
+    """Apply migrations (if enabled), check the schema and seed initial data"""
+    # Schema changes are applied by Alembic, normally as a one-shot
+    # pre-deploy job; RUN_MIGRATIONS=1 runs them here instead
+    if os.getenv("RUN_MIGRATIONS") == "1":
+        logger.info("Applying database migrations...")
+        run_migrations()
+        logger.info("Database migrations applied successfully")
+    
+    with engine.connect() as conn:
+        if not is_schema_migrated(conn):
+            raise RuntimeError("Database schema not found; run 'alembic upgrade head' or set RUN_MIGRATIONS=1")
+    
+    logger.info("Seeding database with initial data...")
+    with get_db_context() as db:
+        seed_database(db)
+    logger.info("Database seeding completed successfully")
+
+def _initialize_database_once():
+    """Run database initialization in exactly one worker; the others wait for it"""
     global _db_initialized
     
+    # Autocommit so this connection never sits in a transaction while the
+    # migrations run; the advisory lock is session-level either way
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.dialect.name != "postgresql":
+            if not _db_initialized:
+                _initialize_database()
+                _db_initialized = True
+            return
+        
+        got_lock = conn.exec_driver_sql(f"SELECT pg_try_advisory_lock({DB_INIT_LOCK_ID})").scalar()
+        if not got_lock:
+            logger.info("Another worker is initializing the database, waiting...")
+            while not conn.exec_driver_sql(f"SELECT pg_try_advisory_lock({DB_INIT_LOCK_ID})").scalar():
+                time.sleep(DB_INIT_POLL_SECONDS)
+        try:
+            if got_lock:
+                _initialize_database()
+            elif not is_schema_migrated(conn):
+                raise RuntimeError("Database initialization failed in another worker")
+        finally:
+            conn.exec_driver_sql(f"SELECT pg_advisory_unlock({DB_INIT_LOCK_ID})")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     # Startup
     print("Starting Smart Home Energy Monitoring API...")
     
-    # Initialize database tables only once
-    if not _db_initialized:
-        try:
-            logger.info("Initializing database tables...")
-            init_users_table()
-            init_devices_table()
-            init_telemetry_table()
-            logger.info("Database tables initialized successfully")
-            
-            # Seed database with initial data only once
-            logger.info("Seeding database with initial data...")
-            with get_db_context() as db:
-                seed_database(db)
-            logger.info("Database seeding completed successfully")
-            
-            _db_initialized = True
-            
-        except Exception as e:
-            logger.error(f"Failed to initialize database: {e}")
-            raise
-    else:
-        logger.info("Database already initialized, skipping initialization")
+    # Drop any pooled connections inherited from a parent process (e.g.
+    # gunicorn --preload) so each worker opens its own
+    engine.dispose(close=False)
+    
+    try:
+        await run_in_threadpool(_initialize_database_once)
+    except Exception as e:
+        logger.error(f"Failed to initialize database: {e}")
+        raise
+    
+    await llm_batcher.start()
+    await telemetry_buffer.start()
     
     yield
     
     # Shutdown
     logger.info("Shutting down Smart Home Energy Monitoring API...")
+    await telemetry_buffer.stop()
+    await llm_batcher.stop()
+    await openai_http_client.aclose()
+    if redis_client is not None:
+        await redis_client.aclose()
+    engine.dispose()
+    await async_engine.dispose()
+    await probe_engine.dispose()
+    HASH_POOL.shutdown(wait=False, cancel_futures=True)
+    _log_listener.stop()
 
 app = FastAPI(
     title="Smart Home Energy Monitoring API",
     description="API for monitoring home energy consumption with conversational AI",
     version="1.0.0",
+    default_response_class=APIJSONResponse,
     lifespan=lifespan
 )
 
@@ -62,13 +130,80 @@ app.include_router(telemetry.router)
 app.include_router(devices.router)
 app.include_router(chat.router)
 
+# Streaming endpoints must not be gzipped: the compressor buffers small
+# chunks and would hold back Server-Sent Events
+UNCOMPRESSED_PATHS = ("/api/chat/stream",)
+
+class StreamingAwareGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Cache-Control policy for GET endpoints, first matching path prefix wins.
+# Per-user data is "private" so shared caches never serve it to someone else.
+CACHE_POLICIES = [
+    ("/api/chat/examples", "public, max-age=300"),
+    ("/api/chat/capabilities", "public, max-age=300"),
+    ("/api/telemetry/", "private, max-age=10"),
+    ("/api/devices/", "private, no-cache"),
+    ("/api/auth/me", "private, no-cache"),
+]
+
+@app.middleware("http")
+async def db_session(request: Request, call_next):
+    """Open one async session per API request, shared by all its dependencies
+
+    The session only checks out a connection on first use, so requests that
+    never touch the database pay nothing.
+    """
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    async with AsyncSessionLocal() as session:
+        request.state.db = session
+        return await call_next(request)
+
+@app.middleware("http")
+async def cache_headers(request: Request, call_next):
+    """Add Cache-Control and ETag headers to JSON GET responses, answering 304 when unchanged"""
+    response = await call_next(request)
+    if request.method != "GET" or response.status_code != 200:
+        return response
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        return response
+    # Handlers that set their own caching headers (and answer 304 themselves)
+    # are left alone
+    if "etag" in response.headers or "cache-control" in response.headers:
+        return response
+    # Streamed bodies (no content-length) are passed through rather than buffered
+    if "content-length" not in response.headers:
+        return response
+
+    policy = next((value for prefix, value in CACHE_POLICIES if request.url.path.startswith(prefix)), None)
+    if policy is None:
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+    headers = dict(response.headers)
+    headers["Cache-Control"] = policy
+    headers["ETag"] = etag
+    if policy.startswith("private"):
+        headers["Vary"] = "Authorization"
+
+    if request.headers.get("if-none-match") == etag:
+        headers.pop("content-length", None)
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, status_code=response.status_code, headers=headers)
+
 @app.get("/")
 def read_root():
     return {"message": "Smart Home Energy Monitoring API"}
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "db_pool": get_pool_status()}
 
 
 # allow CORS from all origins
@@ -78,5 +213,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# compress JSON payloads (added last so it wraps the cache headers middleware)
+app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=500)
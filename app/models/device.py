@@ -1,16 +1,17 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, Uuid
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 from app.utils.db import Base
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+from uuid import UUID, uuid4
 
 class Device(Base):
     __tablename__ = "devices"
     
     id = Column(Integer, primary_key=True, index=True)
-    device_id = Column(String, unique=True, index=True, nullable=False)  # UUID for device
+    device_id = Column(Uuid, unique=True, index=True, nullable=False, default=uuid4)  # UUID for device
     name = Column(String, nullable=False)
     device_type = Column(String, nullable=False)  # fridge, ac, tv, etc.
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -18,9 +19,18 @@ class Device(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
-    # Relationships
-    user = relationship("User", back_populates="devices")
-    telemetry_data = relationship("Telemetry", back_populates="device")
+    # Relationships (never lazy-loaded: load them explicitly with selectinload/joinedload)
+    user = relationship("User", back_populates="devices", lazy="raise")
+    telemetry_data = relationship("Telemetry", back_populates="device", lazy="raise")
+    
+    __table_args__ = (
+        # Serves the paginated device list (newest first per user)
+        Index("ix_devices_user_created", user_id, created_at.desc(), id.desc()),
+        # Serves the owner-scoped lookups, updates and deletes by device UUID
+        Index("ix_devices_user_device", user_id, device_id, unique=True),
+        # Serves case-insensitive lookups by device name (chat queries)
+        Index("ix_devices_user_lower_name", user_id, func.lower(name)),
+    )
 
 # Pydantic models for API
 class DeviceBase(BaseModel):
@@ -28,7 +38,7 @@ class DeviceBase(BaseModel):
     device_type: str
 
 class DeviceCreate(DeviceBase):
-    device_id: Optional[str] = None  # Optional, will be generated if not provided
+    device_id: Optional[UUID] = None  # Optional, will be generated if not provided
 
 class DeviceUpdate(BaseModel):
     name: Optional[str] = None
@@ -37,22 +47,12 @@ class DeviceUpdate(BaseModel):
 
 class DeviceResponse(DeviceBase):
     id: int
-    device_id: str
+    device_id: UUID
     user_id: int
     is_active: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
-    
-    @classmethod
-    def from_orm(cls, obj):
-        return cls(
-            id=obj.id,
-            device_id=obj.device_id,
-            name=obj.name,
-            device_type=obj.device_type,
-            user_id=obj.user_id,
-            is_active=obj.is_active,
-            created_at=obj.created_at
-        ) 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+# Built once at import so list endpoints reuse the compiled validator
+DeviceResponseListAdapter = TypeAdapter(List[DeviceResponse])
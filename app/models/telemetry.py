@@ -1,31 +1,58 @@
-from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, Index
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, Index, Uuid
+from sqlalchemy.sql import func, table, column
 from sqlalchemy.orm import relationship
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, AliasChoices, TypeAdapter
 from app.utils.db import Base
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+from uuid import UUID
 
 class Telemetry(Base):
     __tablename__ = "telemetry"
     
-    id = Column(Integer, primary_key=True, index=True)
+    # TimescaleDB requires the partitioning column (timestamp) in the primary key
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
-    timestamp = Column(DateTime(timezone=True), nullable=False, index=True)
+    device_uuid = Column(Uuid, nullable=False)  # Denormalized Device.device_id
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False)
     energy_watts = Column(Float, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
-    # Relationships
-    device = relationship("Device", back_populates="telemetry_data")
+    # Relationships (never lazy-loaded: load them explicitly with selectinload/joinedload)
+    device = relationship("Device", back_populates="telemetry_data", lazy="raise")
     
-    # Composite index for efficient time-series queries
+    # Composite index for "latest N readings for a device" queries; the
+    # INCLUDE column lets those reads be served from an index-only scan
     __table_args__ = (
-        Index('idx_device_timestamp', 'device_id', 'timestamp'),
+        Index(
+            'idx_device_ts_desc',
+            device_id,
+            timestamp.desc(),
+            postgresql_include=['energy_watts']
+        ),
+        # Time-range filters across devices; BRIN suits append-only timestamps
+        Index('ix_telemetry_timestamp_brin', timestamp, postgresql_using='brin'),
     )
+    
+    # Fetch server defaults (id, created_at) with RETURNING on the INSERT
+    # itself, so ingest needs no refresh SELECT afterwards
+    __mapper_args__ = {"eager_defaults": True}
+
+# Hourly per-device rollup maintained by TimescaleDB (migration 0010). Not
+# part of Base.metadata: it is a continuous aggregate, not a table.
+telemetry_hourly = table(
+    "telemetry_hourly",
+    column("device_id"),
+    column("hour"),
+    column("reading_count"),
+    column("sum_watts"),
+    column("max_watts"),
+    column("min_watts")
+)
 
 # Pydantic models for API
 class TelemetryBase(BaseModel):
-    device_id: str  # UUID string
+    device_id: UUID
     timestamp: datetime
     energy_watts: float
 
@@ -34,28 +61,19 @@ class TelemetryCreate(TelemetryBase):
 
 class TelemetryResponse(BaseModel):
     id: int
-    device_id: str  # UUID string
+    # read from the denormalized column on ORM rows
+    device_id: UUID = Field(validation_alias=AliasChoices("device_uuid", "device_id"))
     timestamp: datetime
     energy_watts: float
     created_at: datetime
     
-    class Config:
-        from_attributes = True
-    
-    @classmethod
-    def from_orm(cls, obj):
-        # Get the device UUID from the relationship
-        device_uuid = obj.device.device_id if obj.device else "unknown"
-        return cls(
-            id=obj.id,
-            device_id=device_uuid,
-            timestamp=obj.timestamp,
-            energy_watts=obj.energy_watts,
-            created_at=obj.created_at
-        )
+    model_config = ConfigDict(from_attributes=True)
 
 class TelemetryQuery(BaseModel):
-    device_id: Optional[str] = None
+    device_id: Optional[UUID] = None
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
-    limit: Optional[int] = 100 
\ No newline at end of file
+    limit: Optional[int] = 100 
+
+# Built once at import so list endpoints reuse the compiled validator
+TelemetryResponseListAdapter = TypeAdapter(List[TelemetryResponse])
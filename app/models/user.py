@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 from app.utils.db import Base
 from datetime import datetime
 from typing import Optional
@@ -18,8 +18,24 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
-    # Relationships
-    devices = relationship("Device", back_populates="user")
+    # Relationships (never lazy-loaded: load them explicitly with selectinload/joinedload)
+    devices = relationship("Device", back_populates="user", lazy="raise")
+    
+    # Covering index so the login lookup by email is an index-only scan;
+    # it must include every column in LOGIN_COLUMNS
+    __table_args__ = (
+        Index(
+            "ix_users_login_covering",
+            "email",
+            postgresql_include=["hashed_password", "is_active", "id", "username", "is_superuser", "created_at"]
+        ),
+    )
+
+# Columns the login lookup reads: what it checks plus what UserResponse returns
+LOGIN_COLUMNS = (
+    User.id, User.email, User.username, User.hashed_password,
+    User.is_active, User.is_superuser, User.created_at
+)
 
 # Pydantic models for API
 class UserBase(BaseModel):
@@ -40,19 +56,7 @@ class UserResponse(UserBase):
     is_superuser: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
-    
-    @classmethod
-    def from_orm(cls, obj):
-        return cls(
-            id=obj.id,
-            email=obj.email,
-            username=obj.username,
-            is_active=obj.is_active,
-            is_superuser=obj.is_superuser,
-            created_at=obj.created_at
-        )
+    model_config = ConfigDict(from_attributes=True)
 
 class UserLogin(BaseModel):
     email: EmailStr
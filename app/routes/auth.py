@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.utils.db import get_db
-from app.utils.jwt import get_current_active_user
+from fastapi.security import HTTPAuthorizationCredentials
+from app.utils.db import get_async_db_context
+from app.utils.jwt import get_current_active_user, revoke_token, security
 from app.services.auth_service import AuthService
 from app.models.user import UserCreate, UserLogin, UserResponse, User
 from typing import Dict
@@ -9,7 +9,7 @@ from typing import Dict
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate):
     """
     Register a new user
 
@@ -72,10 +72,11 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
     - Password will be securely hashed using bcrypt
     - User account is automatically set as active upon creation
     """
-    return AuthService.register_user(db, user_data)
+    async with get_async_db_context() as db:
+        return await AuthService.register_user(db, user_data)
 
 @router.post("/login")
-def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
+async def login(user_credentials: UserLogin):
     """
     Login user and get access token
 
@@ -140,15 +141,19 @@ def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     - Include the token in Authorization header: `Bearer <access_token>`
     - Token expires in 1 hour (3600 seconds) by default
     """
-    return AuthService.login_user(db, user_credentials.email, user_credentials.password)
+    async with get_async_db_context() as db:
+        return await AuthService.login_user(db, user_credentials.email, user_credentials.password)
 
 @router.post("/logout")
-def logout(current_user: User = Depends(get_current_active_user)):
+async def logout(
+    current_user: User = Depends(get_current_active_user),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
     """
-    Logout user (client-side token invalidation)
+    Logout user
 
-    Log the logout action for audit purposes. The actual token invalidation
-    should be handled on the client side by removing the token from storage.
+    Revoke the current access token so it can no longer be used, and log
+    the logout action for audit purposes.
 
     **HTTP Method:** POST  
     **Path:** /api/auth/logout
@@ -191,12 +196,13 @@ def logout(current_user: User = Depends(get_current_active_user)):
     **Notes:**
     - This endpoint logs the logout action for audit purposes
     - Client should remove the access token from local storage
-    - Token remains valid until expiration (server-side invalidation not implemented)
+    - The token is revoked on every worker (through Redis when configured) until it expires
     """
-    return {"message": "Successfully logged out"}
+    await revoke_token(credentials.credentials)
+    return AuthService.logout_user(current_user)
 
 @router.get("/me", response_model=UserResponse)
-def get_current_user_info(current_user: User = Depends(get_current_active_user)):
+async def get_current_user_info(current_user: User = Depends(get_current_active_user)):
     """
     Get current user information
 
@@ -257,4 +263,4 @@ def get_current_user_info(current_user: User = Depends(get_current_active_user))
     - Only returns data for the authenticated user
     - User must be active to access this endpoint
     """
-    return UserResponse.from_orm(current_user)
+    return UserResponse.model_validate(current_user)
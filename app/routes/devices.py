@@ -1,19 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from app.utils.db import get_db
-from app.utils.jwt import get_current_active_user
+import hashlib
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from uuid import UUID
+from app.utils.db import get_async_db
+from app.utils.jwt import get_current_active_user, get_current_user_id
 from app.services.device_service import DeviceService
-from app.models.device import DeviceCreate, DeviceUpdate, DeviceResponse
-from app.models.user import User
-
-router = APIRouter(prefix="/api/devices", tags=["Devices"])
-
-@router.post("/", response_model=DeviceResponse, status_code=status.HTTP_201_CREATED)
-def create_device(
+from app.models.device import DeviceCreate, DeviceUpdate, DeviceResponse, DeviceResponseListAdapter
+from app.utils.responses import APIJSONResponse, not_modified
+
+# Authentication is enforced once for the whole router; handlers only take the
+# user id, which FastAPI resolves from the same cached dependency
+router = APIRouter(
+    prefix="/api/devices",
+    tags=["Devices"],
+    dependencies=[Depends(get_current_active_user)],
+    default_response_class=APIJSONResponse
+)
+
+# Handlers return the encoded response themselves: the service already
+# validated its models from the ORM rows, so FastAPI's response_model pass
+# would only validate them a second time. Schemas stay documented through
+# `responses`.
+
+# Clients revalidate on every read; a matching ETag costs one aggregate query
+DEVICE_CACHE_CONTROL = "private, no-cache"
+
+@router.post("/", response_model=None, status_code=status.HTTP_201_CREATED, responses={201: {"model": DeviceResponse}})
+async def create_device(
     device_data: DeviceCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Create a new device for the current user
@@ -82,6 +99,13 @@ def create_device(
     }
     ```
 
+    **Error Response Example (409 Conflict):**
+    ```json
+    {
+      "detail": "Device with ID 550e8400-e29b-41d4-a716-446655440000 already exists"
+    }
+    ```
+
     **Error Response Example (422 Validation Error):**
     ```json
     {
@@ -101,18 +125,23 @@ def create_device(
     - If device_id is not provided, a UUID will be auto-generated
     - Device types should be consistent (e.g., "ac", "tv", "fridge", "washer")
     """
-    return DeviceService.create_device(db, device_data, current_user.id)
-
-@router.get("/", response_model=List[DeviceResponse])
-def get_my_devices(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    device = await DeviceService.create_device(db, device_data, user_id)
+    return APIJSONResponse(device.model_dump(), status_code=status.HTTP_201_CREATED)
+
+@router.get("/", response_model=None, responses={200: {"model": List[DeviceResponse]}})
+async def get_my_devices(
+    request: Request,
+    response: Response,
+    after: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    limit: int = Query(100, ge=1, le=100, description="Maximum number of devices to return"),
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get all devices owned by the current user
+    Get the devices owned by the current user
 
-    Retrieve a list of all smart home devices associated with the authenticated user.
-    Returns both active and inactive devices.
+    Retrieve the smart home devices associated with the authenticated user,
+    one page at a time. Returns both active and inactive devices.
 
     **HTTP Method:** GET  
     **Path:** /api/devices/
@@ -120,6 +149,10 @@ def get_my_devices(
     **Headers:**
         - Authorization (str, required): Bearer token for authentication
 
+    **Query Parameters:**
+        - after (str, optional): Cursor returned in `X-Next-Cursor` by the previous page
+        - limit (int, optional): Page size (default: 100, max: 100)
+
     **Python Example (requests):**
     ```python
     import requests
@@ -170,18 +203,31 @@ def get_my_devices(
     ```
 
     **Notes:**
-    - Returns all devices owned by the authenticated user
+    - Returns devices owned by the authenticated user
     - Includes both active and inactive devices
     - Empty array is returned if user has no devices
     - Devices are sorted by creation date (newest first)
+    - When more devices exist, the `X-Next-Cursor` response header holds the
+      cursor for the next page; it is absent on the last page
+    - Responses carry an `ETag`; send it back in `If-None-Match` to get
+      `304 Not Modified` while the device list is unchanged
     """
-    return DeviceService.get_user_devices(db, current_user.id)
-
-@router.get("/{device_id}", response_model=DeviceResponse)
-def get_device(
-    device_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    etag = await DeviceService.get_devices_etag(db, user_id, after, limit)
+    if not_modified(request, response, etag, DEVICE_CACHE_CONTROL):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=dict(response.headers))
+    
+    devices, next_cursor = await DeviceService.get_user_devices_page(db, user_id, limit, after)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return APIJSONResponse(DeviceResponseListAdapter.dump_python(devices), headers=dict(response.headers))
+
+@router.get("/{device_id}", response_model=None, responses={200: {"model": DeviceResponse}})
+async def get_device(
+    device_id: UUID,
+    request: Request,
+    response: Response,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get a specific device by ID
@@ -248,21 +294,30 @@ def get_device(
     - Only returns devices owned by the authenticated user
     - Returns 404 if device doesn't exist or belongs to another user
     - Device ID must be a valid UUID format
+    - Responses carry an `ETag`; send it back in `If-None-Match` to get
+      `304 Not Modified` while the device is unchanged
     """
-    device = DeviceService.get_device_by_id(db, device_id, current_user.id)
+    device = await DeviceService.get_device_by_id(db, device_id, user_id)
     if not device:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Device not found or access denied"
         )
-    return device
-
-@router.put("/{device_id}", response_model=DeviceResponse)
-def update_device(
-    device_id: str,
+    
+    # Devices may come from the short-lived device cache, so the tag is taken
+    # from the body actually served rather than from a separate query
+    encoded = APIJSONResponse(device.model_dump())
+    etag = f'"{hashlib.md5(encoded.body).hexdigest()}"'
+    if not_modified(request, response, etag, DEVICE_CACHE_CONTROL):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=dict(response.headers))
+    return Response(encoded.body, media_type=encoded.media_type, headers=dict(response.headers))
+
+@router.put("/{device_id}", response_model=None, responses={200: {"model": DeviceResponse}})
+async def update_device(
+    device_id: UUID,
     device_data: DeviceUpdate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Update a device
@@ -346,13 +401,14 @@ def update_device(
     - Returns 404 if device doesn't exist or belongs to another user
     - Device ID cannot be changed after creation
     """
-    return DeviceService.update_device(db, device_id, device_data, current_user.id)
+    device = await DeviceService.update_device(db, device_id, device_data, user_id)
+    return APIJSONResponse(device.model_dump())
 
 @router.delete("/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_device(
-    device_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+async def delete_device(
+    device_id: UUID,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete a device
@@ -413,5 +469,5 @@ def delete_device(
     - Returns 204 No Content on successful deletion
     - Returns 404 if device doesn't exist or belongs to another user
     """
-    DeviceService.delete_device(db, device_id, current_user.id)
+    await DeviceService.delete_device(db, device_id, user_id)
     return None 
\ No newline at end of file
@@ -1,19 +1,55 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+from uuid import UUID
 from datetime import datetime
-from app.utils.db import get_db
+from app.utils.db import check_database, get_async_db
 from app.utils.jwt import get_current_active_user
-from app.services.telemetry_service import TelemetryService
+from app.services.telemetry_service import TelemetryService, MY_DEVICES_READINGS_LIMIT
+from app.services.telemetry_buffer import telemetry_buffer
 from app.models.telemetry import TelemetryCreate, TelemetryResponse, TelemetryQuery
 from app.models.user import User
-
-router = APIRouter(prefix="/api/telemetry", tags=["Telemetry"])
-
-@router.post("/ingest", response_model=TelemetryResponse, status_code=status.HTTP_201_CREATED)
-def ingest_telemetry(
+from app.utils.responses import APIJSONResponse, data_version_etag, dumps, not_modified
+
+router = APIRouter(prefix="/api/telemetry", tags=["Telemetry"], default_response_class=APIJSONResponse)
+
+# Handlers return the encoded response themselves so FastAPI neither
+# re-validates the models nor walks the payloads with jsonable_encoder;
+# orjson encodes UUIDs and datetimes natively. Schemas stay documented
+# through `responses`.
+
+# Upper bound on readings accepted by /ingest-batch in one request
+MAX_BATCH_SIZE = 5000
+
+# Reads are validated against the user's data version, so a matching
+# If-None-Match is answered with 304 before any query runs
+TELEMETRY_CACHE_CONTROL = "private, max-age=10"
+
+async def _check_not_modified(request: Request, response: Response, user_id: int) -> Optional[Response]:
+    """Return a 304 when the client already holds the current representation"""
+    etag = await data_version_etag(request, user_id)
+    if etag is not None and not_modified(request, response, etag, TELEMETRY_CACHE_CONTROL):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=dict(response.headers))
+    return None
+
+async def _stream_json_array(query):
+    """Encode query rows as one JSON array, a batch of rows per chunk"""
+    yield b"["
+    first = True
+    async for rows in TelemetryService.stream_rows(query):
+        if not rows:
+            continue
+        # orjson encodes the batch as an array; drop its brackets to splice it in
+        chunk = dumps(rows)[1:-1]
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]"
+
+@router.post("/ingest", response_model=None, status_code=status.HTTP_201_CREATED, responses={201: {"model": TelemetryResponse}})
+async def ingest_telemetry(
     telemetry_data: TelemetryCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Ingest telemetry data for a device
@@ -85,17 +121,107 @@ def ingest_telemetry(
     - Energy consumption should be a positive number in watts
     - Device must exist in the system before data can be ingested
     """
-    telemetry = TelemetryService.ingest_telemetry(db, telemetry_data)
-    return TelemetryResponse.from_orm(telemetry)
+    telemetry = await TelemetryService.ingest_telemetry(db, telemetry_data)
+    return APIJSONResponse(
+        TelemetryResponse.model_validate(telemetry).model_dump(),
+        status_code=status.HTTP_201_CREATED
+    )
+
+@router.post("/ingest-batch", status_code=status.HTTP_201_CREATED)
+async def ingest_telemetry_batch(
+    telemetry_items: List[TelemetryCreate],
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Ingest many telemetry readings in one request
+
+    Store a batch of readings with a single COPY and commit. Gateways and
+    collectors that report many readings should prefer this over `/ingest`.
+
+    **HTTP Method:** POST  
+    **Path:** /api/telemetry/ingest-batch
+
+    **Request Body (application/json):**
+        A JSON array of readings, each with:
+        - device_id (str, required): UUID of the device reporting data
+        - timestamp (datetime, required): When the reading was taken (ISO 8601 format)
+        - energy_watts (float, required): Energy consumption in watts
+
+    **Python Example (requests):**
+    ```python
+    import requests
+
+    url = "http://localhost:8000/api/telemetry/ingest-batch"
+    payload = [
+        {"device_id": "550e8400-e29b-41d4-a716-446655440000", "timestamp": "2024-01-15T10:30:00Z", "energy_watts": 1250.5},
+        {"device_id": "550e8400-e29b-41d4-a716-446655440001", "timestamp": "2024-01-15T10:30:00Z", "energy_watts": 150.0}
+    ]
+    response = requests.post(url, json=payload)
+    print(response.json())
+    ```
+
+    **Response Example (201 Created):**
+    ```json
+    {
+      "ingested": 2
+    }
+    ```
+
+    **Notes:**
+    - No authentication required for data ingestion (IoT devices)
+    - At most 5000 readings per request
+    - The batch is rejected with 404 if any device does not exist
+    """
+    if not 0 < len(telemetry_items) <= MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Batch must contain between 1 and {MAX_BATCH_SIZE} readings"
+        )
+    ingested = await TelemetryService.ingest_telemetry_bulk(db, telemetry_items)
+    return {"ingested": ingested}
+
+@router.post("/ingest-buffered", status_code=status.HTTP_202_ACCEPTED)
+async def ingest_telemetry_buffered(telemetry_data: TelemetryCreate):
+    """
+    Queue a single telemetry reading for a batched write
+
+    For devices that cannot batch on their own: the reading is acknowledged
+    immediately and written together with other readings, at most 200 ms
+    later or as soon as 500 readings are waiting.
+
+    **HTTP Method:** POST  
+    **Path:** /api/telemetry/ingest-buffered
+
+    **Request Body (application/json):**
+        Same as `/ingest`.
+
+    **Response Example (202 Accepted):**
+    ```json
+    {
+      "status": "accepted"
+    }
+    ```
 
-@router.get("/device/{device_id}", response_model=List[TelemetryResponse])
-def get_device_telemetry(
-    device_id: str,
+    **Notes:**
+    - No authentication required for data ingestion (IoT devices)
+    - Readings for unknown devices are dropped when the buffer is flushed
+    - Readings still buffered when the server crashes are lost; use
+      `/ingest` or `/ingest-batch` when every reading must be confirmed
+    """
+    await telemetry_buffer.submit(telemetry_data)
+    return {"status": "accepted"}
+
+@router.get("/device/{device_id}", response_model=None, responses={200: {"model": List[TelemetryResponse]}})
+async def get_device_telemetry(
+    request: Request,
+    response: Response,
+    device_id: UUID,
     start_time: Optional[datetime] = Query(None, description="Start time for filtering"),
     end_time: Optional[datetime] = Query(None, description="End time for filtering"),
-    limit: int = Query(100, description="Maximum number of records to return"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of records to return"),
+    before: Optional[datetime] = Query(None, description="Only readings older than this timestamp (next-page cursor)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get telemetry data for a specific device owned by the current user
@@ -113,6 +239,8 @@ def get_device_telemetry(
         - start_time (datetime, optional): Start time filter (ISO 8601 format)
         - end_time (datetime, optional): End time filter (ISO 8601 format)
         - limit (int, optional): Maximum number of records to return (default: 100)
+        - before (datetime, optional): Only return readings strictly older than this;
+          pass the timestamp of the last reading of the previous page
 
     **Headers:**
         - Authorization (str, required): Bearer token for authentication
@@ -181,25 +309,34 @@ def get_device_telemetry(
     - Data is sorted by timestamp (newest first)
     - Time filters use ISO 8601 format
     - Maximum limit is 1000 records per request
+    - Page through older data with `before` set to the last timestamp received;
+      each page is an index seek, however deep
     - Returns empty array if no data found for the specified criteria
     """
-    telemetry_data = TelemetryService.get_telemetry_by_device(
-        db, device_id, current_user.id, start_time, end_time, limit
+    if (cached := await _check_not_modified(request, response, current_user.id)) is not None:
+        return cached
+    query = await TelemetryService.get_telemetry_stream_query(
+        db, device_id, current_user.id, start_time, end_time, limit, before
+    )
+    return StreamingResponse(
+        _stream_json_array(query), media_type="application/json", headers=dict(response.headers)
     )
-    return [TelemetryResponse.from_orm(t) for t in telemetry_data]
 
 @router.get("/my-devices")
-def get_my_devices_telemetry(
+async def get_my_devices_telemetry(
+    request: Request,
+    response: Response,
     start_time: Optional[datetime] = Query(None, description="Start time for filtering"),
     end_time: Optional[datetime] = Query(None, description="End time for filtering"),
+    limit: int = Query(MY_DEVICES_READINGS_LIMIT, ge=1, le=1000, description="Maximum number of readings to return per device"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get telemetry data for all devices owned by the current user
 
     Retrieve energy consumption data for all devices owned by the authenticated user
-    with optional time filtering. Returns aggregated data per device.
+    with optional time filtering. Returns each device's reading count and its latest readings.
 
     **HTTP Method:** GET  
     **Path:** /api/telemetry/my-devices
@@ -207,6 +344,7 @@ def get_my_devices_telemetry(
     **Query Parameters:**
         - start_time (datetime, optional): Start time filter (ISO 8601 format)
         - end_time (datetime, optional): End time filter (ISO 8601 format)
+        - limit (int, optional): Maximum readings per device (default: 100, max: 1000)
 
     **Headers:**
         - Authorization (str, required): Bearer token for authentication
@@ -236,36 +374,32 @@ def get_my_devices_telemetry(
 
     **Response Example (200 OK):**
     ```json
-    {
-      "devices": [
-        {
-          "device_id": "550e8400-e29b-41d4-a716-446655440000",
-          "device_name": "Living Room AC",
-          "device_type": "ac",
-          "total_energy_kwh": 12.5,
-          "average_watts": 1250.5,
-          "peak_watts": 1800.0,
-          "data_points": 288
-        },
-        {
-          "device_id": "550e8400-e29b-41d4-a716-446655440001",
-          "device_name": "Kitchen Fridge",
-          "device_type": "fridge",
-          "total_energy_kwh": 8.2,
-          "average_watts": 820.0,
-          "peak_watts": 1200.0,
-          "data_points": 288
-        }
-      ],
-      "summary": {
-        "total_devices": 2,
-        "total_energy_kwh": 20.7,
-        "period": {
-          "start": "2024-01-15T00:00:00Z",
-          "end": "2024-01-15T23:59:59Z"
-        }
+    [
+      {
+        "device_id": "550e8400-e29b-41d4-a716-446655440000",
+        "device_name": "Living Room AC",
+        "device_type": "ac",
+        "telemetry_count": 288,
+        "telemetry_data": [
+          {
+            "id": 1,
+            "device_id": "550e8400-e29b-41d4-a716-446655440000",
+            "timestamp": "2024-01-15T23:55:00Z",
+            "energy_watts": 1250.5,
+            "created_at": "2024-01-15T23:55:01Z"
+          }
+        ],
+        "truncated": true
+      },
+      {
+        "device_id": "550e8400-e29b-41d4-a716-446655440001",
+        "device_name": "Kitchen Fridge",
+        "device_type": "fridge",
+        "telemetry_count": 0,
+        "telemetry_data": [],
+        "truncated": false
       }
-    }
+    ]
     ```
 
     **Error Response Example (401 Unauthorized):**
@@ -276,23 +410,28 @@ def get_my_devices_telemetry(
     ```
 
     **Notes:**
-    - Returns aggregated data for all user's devices
-    - Energy consumption is converted to kWh for easier understanding
-    - Includes device metadata (name, type) for context
-    - Returns summary statistics for the entire period
-    - Empty response if user has no devices or no data in time range
+    - One entry per device the user owns, including devices without readings
+    - telemetry_count counts every reading in the time range
+    - telemetry_data holds the latest readings in the range, newest first, at most `limit` per device
+    - truncated is true when the device has more readings in the range than telemetry_data holds;
+      page through them with /api/telemetry/device/{device_id}
+    - Empty list if the user has no devices
     """
-    return TelemetryService.get_user_devices_telemetry(
-        db, current_user.id, start_time, end_time
-    )
+    if (cached := await _check_not_modified(request, response, current_user.id)) is not None:
+        return cached
+    return APIJSONResponse(await TelemetryService.get_user_devices_telemetry(
+        db, current_user.id, start_time, end_time, limit
+    ), headers=dict(response.headers))
 
 @router.get("/summary")
-def get_energy_summary(
-    device_id: Optional[str] = Query(None, description="Specific device ID (optional)"),
+async def get_energy_summary(
+    request: Request,
+    response: Response,
+    device_id: Optional[UUID] = Query(None, description="Specific device ID (optional)"),
     start_time: Optional[datetime] = Query(None, description="Start time for filtering"),
     end_time: Optional[datetime] = Query(None, description="End time for filtering"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get energy usage summary for devices
@@ -391,17 +530,21 @@ def get_energy_summary(
     - Peak/lowest hours are based on 24-hour cycle
     - Device breakdown shows percentage contribution to total consumption
     """
-    return TelemetryService.get_energy_summary(
+    if (cached := await _check_not_modified(request, response, current_user.id)) is not None:
+        return cached
+    return APIJSONResponse(await TelemetryService.get_energy_summary(
         db, current_user.id, device_id, start_time, end_time
-    )
+    ), headers=dict(response.headers))
 
 @router.get("/top-consuming")
-def get_top_consuming_devices(
+async def get_top_consuming_devices(
+    request: Request,
+    response: Response,
     limit: int = Query(3, description="Number of top devices to return"),
     start_time: Optional[datetime] = Query(None, description="Start time for filtering"),
     end_time: Optional[datetime] = Query(None, description="End time for filtering"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get top energy consuming devices for the current user
@@ -509,12 +652,14 @@ def get_top_consuming_devices(
     - Returns empty array if user has no devices or no data
     - Maximum limit is 10 devices for performance reasons
     """
-    return TelemetryService.get_top_consuming_devices(
+    if (cached := await _check_not_modified(request, response, current_user.id)) is not None:
+        return cached
+    return APIJSONResponse(await TelemetryService.get_top_consuming_devices(
         db, current_user.id, limit, start_time, end_time
-    )
+    ), headers=dict(response.headers))
 
 @router.get("/health")
-def telemetry_health_check():
+async def telemetry_health_check():
     """
     Health check for telemetry service
 
@@ -553,4 +698,45 @@ def telemetry_health_check():
     - Returns basic service status information
     - Useful for load balancers and monitoring systems
     """
-    return {"status": "healthy", "service": "telemetry"} 
\ No newline at end of file
+    return {"status": "healthy", "service": "telemetry"} 
+
+@router.get("/ready")
+async def telemetry_readiness_check():
+    """
+    Readiness check for telemetry service
+
+    Confirms the database answers a trivial query. Probes use their own
+    small connection pool, so frequent checks never take connections from
+    request traffic. No authentication required.
+
+    **HTTP Method:** GET  
+    **Path:** /api/telemetry/ready
+
+    **Response Example (200 OK):**
+    ```json
+    {
+      "status": "ready",
+      "service": "telemetry"
+    }
+    ```
+
+    **Error Response Example (503 Service Unavailable):**
+    ```json
+    {
+      "status": "unavailable",
+      "service": "telemetry"
+    }
+    ```
+
+    **Notes:**
+    - Use `/health` for liveness (no database access) and `/ready` for readiness
+    - Responses are never cached (`Cache-Control: no-store`)
+    """
+    headers = {"Cache-Control": "no-store"}
+    if await check_database():
+        return APIJSONResponse({"status": "ready", "service": "telemetry"}, headers=headers)
+    return APIJSONResponse(
+        {"status": "unavailable", "service": "telemetry"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers=headers
+    )
@@ -1,7 +1,10 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
-from app.models.user import User, UserCreate, UserResponse
-from app.utils.hashing import get_password_hash, verify_password
+from app.models.user import User, UserCreate, UserResponse, LOGIN_COLUMNS
+from app.utils.hashing import get_password_hash_async, verify_password_async
 from app.utils.jwt import create_access_token
 from typing import Optional
 import logging
@@ -9,98 +12,111 @@ import logging
 logger = logging.getLogger(__name__)
 
 class AuthService:
-    
+
     @staticmethod
-    def register_user(db: Session, user_data: UserCreate) -> UserResponse:
-        """Register a new user"""
-        # Check if user already exists
-        existing_user = db.query(User).filter(
-            (User.email == user_data.email) | (User.username == user_data.username)
-        ).first()
-        
-        if existing_user:
-            if existing_user.email == user_data.email:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Email already registered"
-                )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Username already taken"
-                )
-        
-        # Create new user
-        hashed_password = get_password_hash(user_data.password)
-        db_user = User(
-            email=user_data.email,
-            username=user_data.username,
-            hashed_password=hashed_password
-        )
-        
+    async def register_user(db: AsyncSession, user_data: UserCreate) -> UserResponse:
+        """Register a new user
+
+        The insert itself detects duplicates (ON CONFLICT DO NOTHING), so
+        there is no separate existence check and no window in which two
+        concurrent registrations can both pass it.
+        """
+        hashed_password = await get_password_hash_async(user_data.password)
+
         try:
-            db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
-            logger.info(f"New user registered: {user_data.email}")
-            return UserResponse.from_orm(db_user)
+            result = await db.execute(
+                pg_insert(User)
+                .values(
+                    email=user_data.email,
+                    username=user_data.username,
+                    hashed_password=hashed_password
+                )
+                .on_conflict_do_nothing()
+                .returning(User)
+            )
+            db_user = result.scalars().first()
+            if db_user is not None:
+                response = UserResponse.model_validate(db_user)
+                await db.commit()
+                logger.info(f"New user registered: {user_data.email}")
+                return response
+            await db.rollback()
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Error registering user: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Error creating user"
             )
-    
+
+        # Nothing inserted: only now look up which unique field collided
+        if await AuthService.get_user_by_email(db, user_data.email):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already taken"
+        )
+
     @staticmethod
-    def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
+    async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[User]:
         """Authenticate user with email and password"""
-        user = db.query(User).filter(User.email == email).first()
+        user = await AuthService.get_user_by_email(db, email)
         if not user:
             return None
-        if not verify_password(password, user.hashed_password):
+        if not await verify_password_async(password, user.hashed_password):
             return None
         return user
-    
+
     @staticmethod
-    def login_user(db: Session, email: str, password: str) -> dict:
+    async def login_user(db: AsyncSession, email: str, password: str) -> dict:
         """Login user and return access token"""
-        user = AuthService.authenticate_user(db, email, password)
+        user = await AuthService.authenticate_user(db, email, password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        
+
         if not user.is_active:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Inactive user"
             )
-        
+
         # Create access token
         access_token = create_access_token(data={"sub": str(user.id)})
-        
+
         logger.info(f"User logged in: {email}")
         return {
             "access_token": access_token,
             "token_type": "bearer",
-            "user": UserResponse.from_orm(user)
+            "user": UserResponse.model_validate(user)
         }
-    
+
     @staticmethod
     def logout_user(user: User) -> dict:
         """Logout user (client-side token invalidation)"""
         logger.info(f"User logged out: {user.email}")
         return {"message": "Successfully logged out"}
-    
+
     @staticmethod
-    def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
+    async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[User]:
         """Get user by ID"""
-        return db.query(User).filter(User.id == user_id).first()
-    
+        result = await db.execute(select(User).where(User.id == user_id))
+        return result.scalar_one_or_none()
+
     @staticmethod
-    def get_user_by_email(db: Session, email: str) -> Optional[User]:
-        """Get user by email"""
-        return db.query(User).filter(User.email == email).first() 
\ No newline at end of file
+    async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+        """Get user by email
+
+        Only the login columns are loaded, so the lookup is answered from
+        the covering index without visiting the table.
+        """
+        result = await db.execute(
+            select(User).options(load_only(*LOGIN_COLUMNS)).where(User.email == email)
+        )
+        return result.scalar_one_or_none()
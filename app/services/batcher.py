@@ -0,0 +1,102 @@
+from typing import Any, List, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_BATCH = int(os.getenv("CHAT_BATCH_MAX_SIZE", "16"))
+MAX_WAIT_SECONDS = int(os.getenv("CHAT_BATCH_MAX_WAIT_MS", "75")) / 1000
+
+class LLMBatcher:
+    """Collects concurrent LLM calls into micro-batches sent over one shared client.
+
+    A call that finds no other call queued behind it is dispatched at once,
+    so an uncontended call pays no batching delay. Under contention, calls
+    arriving within MAX_WAIT_SECONDS of each other (up to MAX_BATCH) are
+    dispatched together with ``llm.abatch``. Until ``start`` is called,
+    ``submit`` simply invokes the model directly.
+    """
+
+    def __init__(self, llm, max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT_SECONDS):
+        self.llm = llm
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """Start the background worker on the running event loop"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+            logger.info("LLM batcher started (max_batch=%s, max_wait=%ss)", self.max_batch, self.max_wait)
+
+    async def stop(self):
+        """Stop the worker, finish calls already taken from the queue and fail the rest"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        if self._dispatches:
+            await asyncio.gather(*self._dispatches, return_exceptions=True)
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("LLM batcher stopped"))
+
+    async def submit(self, messages: List[Any]) -> Any:
+        """Queue a model call and wait for its result"""
+        if self._worker is None:
+            return await self.llm.ainvoke(messages)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((messages, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                # Only wait for more calls when others are already queued
+                if not self._queue.empty():
+                    deadline = loop.time() + self.max_wait
+                    while len(batch) < self.max_batch:
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                        except asyncio.TimeoutError:
+                            break
+            finally:
+                # Also runs when stop() cancels the worker mid-collection, so
+                # calls already taken off the queue are still answered
+                self._start_dispatch(batch)
+
+    def _start_dispatch(self, batch: List[Tuple[List[Any], asyncio.Future]]):
+        """Dispatch without blocking collection of the next batch"""
+        task = asyncio.create_task(self._dispatch(batch))
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[List[Any], asyncio.Future]]):
+        try:
+            results = await self.llm.abatch([messages for messages, _ in batch], return_exceptions=True)
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
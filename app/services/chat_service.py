@@ -1,29 +1,54 @@
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import TypedDict, List, Dict, Any, Optional, AsyncIterator, Tuple, Literal
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langchain_openai import ChatOpenAI
 from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, END
+from cachetools import LRUCache
 from enum import Enum, auto
+from functools import lru_cache
+from redis.exceptions import RedisError
+import hashlib
+import httpx
 import logging
+import orjson
 import os
-import json
+import re
+import uuid
 from dotenv import load_dotenv
 load_dotenv()
 
 from app.models.user import User
 from app.services.telemetry_service import TelemetryService
 from app.services.device_service import DeviceService
+from app.services.semantic_cache import SemanticCache, SEMANTIC_CACHE_ENABLED
+from app.services.batcher import LLMBatcher
+from app.utils.cache import get_user_data_version, redis_client
 
 logger = logging.getLogger(__name__)
 
 # Configuration
-OPENAI_MODEL = "gpt-4o"
+# The model only classifies queries and extracts parameters; answers are
+# built from database results, so a small model is enough
+OPENAI_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+ANALYSIS_CACHE_SIZE = int(os.getenv("CHAT_ANALYSIS_CACHE_SIZE", "2048"))
+ANALYSIS_CACHE_TTL = int(os.getenv("CHAT_ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+
+# One pooled HTTP/2 client shared by every OpenAI call in the process, so
+# concurrent requests reuse connections instead of handshaking per call
+openai_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+    timeout=httpx.Timeout(60.0, connect=5.0)
+)
+
 llm = ChatOpenAI(
     model_name=OPENAI_MODEL,
     temperature=0.0,
-    openai_api_key=os.environ.get("OPENAI_API_KEY")
+    openai_api_key=os.environ.get("OPENAI_API_KEY"),
+    http_async_client=openai_http_client
 )
 
 # State definitions
@@ -38,7 +63,9 @@ class OutputState(TypedDict):
     data: Optional[Dict[str, Any]]
 
 class InternalState(InputState, total=False):
-    intent: str
+    # Kept as the enum member; the state is never checkpointed, and only
+    # stream_query turns it into its name for the client
+    intent: "QueryIntent"
     parsed_query: Dict[str, Any]
     answer: str
     data: Optional[Dict[str, Any]]
@@ -55,9 +82,33 @@ class QueryIntent(Enum):
     GOODBYE = auto()
     OFF_TOPIC = auto()
 
-def classify_intent(query: str) -> QueryIntent:
-    """Classify the intent of the user query"""
-    system_prompt = SystemMessage(content="""
+# Intents answered without touching the database
+SMALL_TALK_INTENTS = (QueryIntent.GREETING, QueryIntent.THANKS, QueryIntent.GOODBYE, QueryIntent.OFF_TOPIC)
+
+class ParsedQuery(BaseModel):
+    """Parameters extracted from an energy query; unset fields stay None"""
+    device_name: Optional[str] = Field(None, description="Device name if specified")
+    device_type: Optional[str] = Field(None, description="Device type if specified")
+    time_period: Optional[str] = Field(None, description="today, yesterday, last_week, last_month or specific_hours")
+    start_time: Optional[str] = Field(None, description="Start time if specified")
+    end_time: Optional[str] = Field(None, description="End time if specified")
+    comparison: Optional[bool] = Field(None, description="True if comparing devices")
+    aggregation: Optional[str] = Field(None, description="total, average, max or min")
+    limit: Optional[int] = Field(None, description="Number of results to return")
+
+# The intent names as a closed set, so the schema constrains the model's
+# choice instead of the reply being scrubbed and checked afterwards
+IntentName = Literal[tuple(QueryIntent.__members__)]
+
+class QueryAnalysis(BaseModel):
+    """Intent and parameters of a user query, produced by a single model call"""
+    intent: IntentName = Field(description="The intent category")
+    parsed: ParsedQuery = Field(default_factory=ParsedQuery)
+
+# The system prompt is a module-level constant and always sent first, ahead
+# of the user's query, so every request shares a byte-identical prefix that
+# the provider's prompt cache can reuse. Keep dynamic values out of it.
+ANALYSIS_SYSTEM_PROMPT = SystemMessage(content="""
     You are an energy monitoring assistant. Classify the user's intent into one of these categories:
     
     - ENERGY_USAGE: Questions about specific device energy consumption
@@ -70,380 +121,378 @@ def classify_intent(query: str) -> QueryIntent:
     - GOODBYE: Goodbye, bye, see you
     - OFF_TOPIC: Not related to energy monitoring
     
-    Respond with ONLY the intent category name (e.g., "ENERGY_USAGE").
-    Do not include any other text or formatting.
+    For ENERGY_USAGE, DEVICE_COMPARISON, TOP_CONSUMERS and ENERGY_SUMMARY, also
+    extract the query parameters (device name or type, time period, start and
+    end time, comparison, aggregation, result limit). Leave parameters that the
+    query does not mention unset, and leave all of them unset for other intents.
     """)
-    
+
+# Structured output lets LangChain enforce the schema, so replies need no
+# fence stripping or manual JSON parsing
+analysis_llm = llm.with_structured_output(QueryAnalysis, method="function_calling")
+# Concurrent chat requests share micro-batched calls to the model
+llm_batcher = LLMBatcher(analysis_llm)
+
+# Intents whose answers depend on the extracted parameters
+PARSED_INTENTS = (QueryIntent.ENERGY_USAGE, QueryIntent.DEVICE_COMPARISON, QueryIntent.TOP_CONSUMERS, QueryIntent.ENERGY_SUMMARY)
+
+# Analyses of recently seen queries. They depend only on the query text
+# (time periods stay relative, e.g. "today"), not on the user or their
+# data, so repeats across users skip the model call entirely. The local
+# LRU fronts a Redis copy shared by all workers when REDIS_URL is set.
+_analysis_cache = LRUCache(maxsize=ANALYSIS_CACHE_SIZE)
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def _analysis_key(normalized: str) -> str:
+    # The model is part of the key so switching CHAT_MODEL starts afresh
+    digest = hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+    return f"chat:analysis:{OPENAI_MODEL}:{digest}"
+
+async def _load_shared_analysis(normalized: str) -> Optional[Tuple[QueryIntent, Dict[str, Any]]]:
+    if redis_client is None:
+        return None
     try:
-        response = llm.invoke([system_prompt, HumanMessage(content=query)])
-        intent_str = response.content.strip().upper()
-        
-        # Clean up common variations
-        intent_str = intent_str.replace(' ', '_')
-        
-        logger.info(f"Classified intent '{query}' as: {intent_str}")
-        
-        try:
-            return QueryIntent[intent_str]
-        except (KeyError, ValueError):
-            logger.warning(f"Unknown intent '{intent_str}', defaulting to OFF_TOPIC")
-            return QueryIntent.OFF_TOPIC
-            
-    except Exception as e:
-        logger.error(f"Error classifying intent for query '{query}': {e}")
-        return QueryIntent.OFF_TOPIC
-
-def parse_energy_query(query: str) -> Dict[str, Any]:
-    """Parse energy-related queries to extract parameters"""
-    system_prompt = SystemMessage(content="""
-    Parse the user's energy monitoring query and extract relevant parameters.
-    You must respond with ONLY a valid JSON object with these fields:
-    
-    {
-        "device_name": "device name if specified or null",
-        "device_type": "device type if specified or null", 
-        "time_period": "time period (today, yesterday, last_week, last_month, specific_hours) or null",
-        "start_time": "start time if specified or null",
-        "end_time": "end_time if specified or null",
-        "comparison": "true if comparing devices or null",
-        "aggregation": "type of aggregation (total, average, max, min) or null",
-        "limit": "number of results to return or null"
-    }
-    
-    Only include fields that are relevant to the query. Use null for unspecified values.
-    Do not include any text before or after the JSON object.
-    """)
+        payload = await redis_client.get(_analysis_key(normalized))
+    except RedisError as e:
+        logger.warning("Redis read failed for chat analysis: %s", e)
+        return None
+    if payload is None:
+        return None
+    cached = orjson.loads(payload)
+    return QueryIntent[cached["intent"]], cached["parsed"]
+
+async def _store_shared_analysis(normalized: str, intent: QueryIntent, parsed: Dict[str, Any]) -> None:
+    if redis_client is None:
+        return
+    try:
+        await redis_client.setex(
+            _analysis_key(normalized), ANALYSIS_CACHE_TTL,
+            orjson.dumps({"intent": intent.name, "parsed": parsed})
+        )
+    except RedisError as e:
+        logger.warning("Redis write failed for chat analysis: %s", e)
+
+# Unambiguous phrasings answered without a model call, matched against the
+# normalized query. Small talk must be the whole message so that e.g.
+# "hi, what did my fridge use today?" still reaches the model.
+_FAST_INTENT_PATTERNS: List[Tuple[re.Pattern, QueryIntent]] = [
+    (re.compile(r"^(hi|hello|hey|good (morning|afternoon|evening))( there)?[\s!.,]*$"), QueryIntent.GREETING),
+    (re.compile(r"^(thanks|thank you|thx)( (so|very) much)?[\s!.,]*$"), QueryIntent.THANKS),
+    (re.compile(r"^(bye|goodbye|see you( later)?)[\s!.,]*$"), QueryIntent.GOODBYE),
+    (re.compile(r"^((list|show)( me)?( all)? my devices|what devices do i have)[\s?!.]*$"), QueryIntent.DEVICE_LIST),
+    (re.compile(r"\btop \d+\b|\bwhich devices? (uses?|used|consumes?|consumed) the most\b"), QueryIntent.TOP_CONSUMERS),
+]
+_FAST_LIMIT_PATTERN = re.compile(r"\btop (\d+)\b")
+_FAST_TIME_PERIODS = [("yesterday", "yesterday"), ("today", "today"), ("last week", "last_week"), ("last month", "last_month")]
+
+def _fast_classify(normalized: str) -> Optional[Tuple[QueryIntent, Dict[str, Any]]]:
+    """Resolve the query with patterns alone, or None when the model is needed"""
+    for pattern, intent in _FAST_INTENT_PATTERNS:
+        if pattern.search(normalized):
+            break
+    else:
+        return None
+    
+    parsed: Dict[str, Any] = {}
+    if intent == QueryIntent.TOP_CONSUMERS:
+        if match := _FAST_LIMIT_PATTERN.search(normalized):
+            parsed["limit"] = int(match.group(1))
+        for phrase, time_period in _FAST_TIME_PERIODS:
+            if phrase in normalized:
+                parsed["time_period"] = time_period
+                break
+    return intent, parsed
+
+async def classify_and_parse(query: str) -> Tuple[QueryIntent, Dict[str, Any]]:
+    """Classify the intent of the user query and extract its parameters in one model call"""
+    key = _normalize(query)
+    fast = _fast_classify(key)
+    if fast is not None:
+        return fast
+    
+    cached = _analysis_cache.get(key)
+    if cached is None:
+        cached = await _load_shared_analysis(key)
+        if cached is not None:
+            _analysis_cache[key] = cached
+    if cached is not None:
+        intent, parsed = cached
+        return intent, dict(parsed)
     
     try:
-        response = llm.invoke([system_prompt, HumanMessage(content=query)])
-        content = response.content.strip()
-        
-        # Try to extract JSON if there's extra text
-        if content.startswith('```json'):
-            content = content[7:]
-        if content.endswith('```'):
-            content = content[:-3]
-        content = content.strip()
-        
-        # If content is empty or just whitespace, return empty dict
-        if not content:
-            logger.warning(f"Empty response from LLM for query: {query}")
-            return {}
-            
-        parsed = json.loads(content)
-        logger.info(f"Successfully parsed query: {parsed}")
-        return parsed
-        
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error for query '{query}': {e}")
-        logger.error(f"LLM response content: '{response.content if 'response' in locals() else 'No response'}'")
-        return {}
+        analysis = await llm_batcher.submit([ANALYSIS_SYSTEM_PROMPT, HumanMessage(content=query)])
     except Exception as e:
-        logger.error(f"Error parsing query '{query}': {e}")
-        return {}
+        logger.error("Error analyzing query '%s': %s", query, e)
+        return QueryIntent.OFF_TOPIC, {}
+    
+    intent = QueryIntent[analysis.intent]
+    parsed = analysis.parsed.model_dump(exclude_none=True) if intent in PARSED_INTENTS else {}
+    logger.info("Classified intent '%s' as: %s, parsed: %s", query, intent.name, parsed)
+    # Failures above fall back to OFF_TOPIC and are deliberately not cached
+    _analysis_cache[key] = (intent, parsed)
+    await _store_shared_analysis(key, intent, parsed)
+    return intent, dict(parsed)
+
+# Days between the start of today and the start of each period
+_TIME_PERIOD_DAYS = {"today": 0, "yesterday": 1, "last_week": 7, "last_month": 30}
+
+# Open periods end at the next multiple of this many seconds rather than at
+# the current instant, so queries within one bucket share a telemetry cache key
+TIME_RANGE_BUCKET_SECONDS = 30
 
 def get_time_range(time_period: str) -> tuple[Optional[datetime], Optional[datetime]]:
     """Convert time period to start and end times"""
-    now = datetime.utcnow()
-    
-    if time_period == "today":
-        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        return start, now
-    elif time_period == "yesterday":
-        start = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        end = start.replace(hour=23, minute=59, second=59)
-        return start, end
-    elif time_period == "last_week":
-        start = (now - timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
-        return start, now
-    elif time_period == "last_month":
-        start = (now - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
-        return start, now
-    else:
+    days = _TIME_PERIOD_DAYS.get(time_period)
+    if days is None:
         return None, None
+    
+    now = datetime.utcnow()
+    start_of_today = now - timedelta(
+        hours=now.hour, minutes=now.minute, seconds=now.second, microseconds=now.microsecond
+    )
+    start = start_of_today - timedelta(days=days)
+    if time_period == "yesterday":
+        # The only closed period
+        return start, start_of_today - timedelta(microseconds=1)
+    # The others run up to now, rounded up to the bucket boundary (no
+    # reading can be newer than now, so rounding up loses nothing)
+    elapsed = (now - start_of_today).total_seconds()
+    buckets = -(-elapsed // TIME_RANGE_BUCKET_SECONDS)
+    return start, start_of_today + timedelta(seconds=buckets * TIME_RANGE_BUCKET_SECONDS)
 
-def generate_response(state: InternalState, db: Session) -> InternalState:
+async def generate_response(state: InternalState, db: AsyncSession) -> InternalState:
     """Generate response based on intent and parsed query"""
-    intent = QueryIntent[state["intent"]]
+    intent = state["intent"]
     parsed_query = state.get("parsed_query", {})
     
-    if intent in [QueryIntent.GREETING, QueryIntent.THANKS, QueryIntent.GOODBYE, QueryIntent.OFF_TOPIC]:
+    if intent in SMALL_TALK_INTENTS:
         return generate_small_talk_response(state)
     
     try:
         if intent == QueryIntent.ENERGY_USAGE:
-            return handle_energy_usage_query(state, parsed_query, db)
+            return await handle_energy_usage_query(state, parsed_query, db)
         elif intent == QueryIntent.DEVICE_COMPARISON:
-            return handle_device_comparison_query(state, parsed_query, db)
+            return await handle_device_comparison_query(state, parsed_query, db)
         elif intent == QueryIntent.TOP_CONSUMERS:
-            return handle_top_consumers_query(state, parsed_query, db)
+            return await handle_top_consumers_query(state, parsed_query, db)
         elif intent == QueryIntent.ENERGY_SUMMARY:
-            return handle_energy_summary_query(state, parsed_query, db)
+            return await handle_energy_summary_query(state, parsed_query, db)
         elif intent == QueryIntent.DEVICE_LIST:
-            return handle_device_list_query(state, db)
+            return await handle_device_list_query(state, db)
         else:
             return generate_fallback_response(state)
     except Exception as e:
-        logger.error(f"Error generating response: {e}")
+        logger.exception("Error generating response")
         return generate_error_response(state)
 
+# Fixed answers, built once at import
+SMALL_TALK_RESPONSES = {
+    QueryIntent.GREETING: "Hello! I'm your smart home energy assistant. I can help you monitor your energy usage, compare devices, and find ways to save energy. What would you like to know about your energy consumption?",
+    QueryIntent.THANKS: "You're welcome! Feel free to ask me anything about your energy usage anytime.",
+    QueryIntent.GOODBYE: "Goodbye! Have a great day and remember to monitor your energy usage!",
+    QueryIntent.OFF_TOPIC: "I'm here to help you with energy monitoring questions. You can ask me about device energy usage, comparisons, or energy summaries."
+}
+
+FALLBACK_RESPONSE = "\n".join([
+    "I'm not sure I understood your question. I can help you with:",
+    "• Energy usage for specific devices",
+    "• Comparing energy consumption between devices",
+    "• Finding your highest energy consuming devices",
+    "• Energy usage summaries",
+    "• Listing your devices"
+])
+
+ERROR_RESPONSE = "Sorry, I encountered an error while processing your request. Please try again or rephrase your question."
+
+def _format_top_consumers(title: str, top_consumers: List[Dict[str, Any]]) -> str:
+    return title + "".join(
+        f"{i}. {device['name']} ({device['type']}): {device['average_power_watts']:.1f} watts\n"
+        for i, device in enumerate(top_consumers, 1)
+    )
+
+def _answer(state: InternalState, answer: str, data: Optional[Dict[str, Any]] = None) -> InternalState:
+    """Record the answer (and any structured data) on the state in place"""
+    state["answer"] = answer
+    if data is not None:
+        state["data"] = data
+    return state
+
 def generate_small_talk_response(state: InternalState) -> InternalState:
     """Generate small talk responses"""
-    intent = QueryIntent[state["intent"]]
-    
-    if intent == QueryIntent.GREETING:
-        response = "Hello! I'm your smart home energy assistant. I can help you monitor your energy usage, compare devices, and find ways to save energy. What would you like to know about your energy consumption?"
-    elif intent == QueryIntent.THANKS:
-        response = "You're welcome! Feel free to ask me anything about your energy usage anytime."
-    elif intent == QueryIntent.GOODBYE:
-        response = "Goodbye! Have a great day and remember to monitor your energy usage!"
-    else:
-        response = "I'm here to help you with energy monitoring questions. You can ask me about device energy usage, comparisons, or energy summaries."
-    
-    return {**state, "answer": response}
+    intent = state["intent"]
+    response = SMALL_TALK_RESPONSES.get(intent, SMALL_TALK_RESPONSES[QueryIntent.OFF_TOPIC])
+    return _answer(state, response)
 
-def handle_energy_usage_query(state: InternalState, parsed_query: Dict[str, Any], db: Session) -> InternalState:
+async def handle_energy_usage_query(state: InternalState, parsed_query: Dict[str, Any], db: AsyncSession) -> InternalState:
     """Handle energy usage queries for specific devices"""
     device_name = parsed_query.get("device_name")
     time_period = parsed_query.get("time_period", "today")
     start_time, end_time = get_time_range(time_period)
     
-    # Get user's devices
-    devices = DeviceService.get_user_devices(db, state["user_id"])
-    
     if device_name:
         # Find specific device
-        target_device = None
-        for device in devices:
-            if device.name.lower() == device_name.lower():
-                target_device = device
-                break
+        target_device = await DeviceService.get_device_by_name(db, state["user_id"], device_name)
         
         if not target_device:
-            return {**state, "answer": f"I couldn't find a device named '{device_name}'. Here are your devices: {', '.join([d.name for d in devices])}"}
+            # Only list the user's devices for the error message
+            devices = await DeviceService.get_user_devices_lite(db, state["user_id"])
+            return _answer(state, f"I couldn't find a device named '{device_name}'. Here are your devices: {', '.join([d.name for d in devices])}")
         
-        # Get energy data for specific device
-        telemetry_data = TelemetryService.get_telemetry_by_device(
-            db, target_device.device_id, state["user_id"], start_time, end_time, limit=100
+        # Aggregated in SQL (from the hourly rollup where possible) rather
+        # than loading readings and reducing them here
+        stats = await TelemetryService.get_energy_summary(
+            db, state["user_id"], target_device.device_id, start_time, end_time
         )
         
-        if not telemetry_data:
-            return {**state, "answer": f"No energy data found for {device_name} in the specified time period."}
+        if not stats["reading_count"]:
+            return _answer(state, f"No energy data found for {device_name} in the specified time period.")
         
-        # Calculate summary
-        total_energy = sum(t.energy_watts for t in telemetry_data)
-        avg_energy = total_energy / len(telemetry_data)
-        max_energy = max(t.energy_watts for t in telemetry_data)
+        avg_energy = stats["average_power_watts"]
+        max_energy = stats["max_power_watts"]
         
-        response = f"Energy usage for {device_name} ({time_period}):\n"
-        response += f"• Average power: {avg_energy:.1f} watts\n"
-        response += f"• Peak power: {max_energy:.1f} watts\n"
-        response += f"• Total readings: {len(telemetry_data)}"
+        response = (
+            f"Energy usage for {device_name} ({time_period}):\n"
+            f"• Average power: {avg_energy:.1f} watts\n"
+            f"• Peak power: {max_energy:.1f} watts\n"
+            f"• Total readings: {stats['reading_count']}"
+        )
         
-        return {**state, "answer": response, "data": {
+        return _answer(state, response, {
             "device_name": device_name,
             "average_power": avg_energy,
             "max_power": max_energy,
-            "readings_count": len(telemetry_data)
-        }}
+            "readings_count": stats["reading_count"]
+        })
     
     else:
         # Get summary for all devices
-        summary = TelemetryService.get_energy_summary(db, state["user_id"], start_time=start_time, end_time=end_time)
+        summary = await TelemetryService.get_energy_summary(
+            db, state["user_id"], start_time=start_time, end_time=end_time
+        )
         
-        response = f"Energy summary for all devices ({time_period}):\n"
-        response += f"• Average power: {summary['average_power_watts']:.1f} watts\n"
-        response += f"• Peak power: {summary['max_power_watts']:.1f} watts\n"
-        response += f"• Total readings: {summary['reading_count']}"
+        response = (
+            f"Energy summary for all devices ({time_period}):\n"
+            f"• Average power: {summary['average_power_watts']:.1f} watts\n"
+            f"• Peak power: {summary['max_power_watts']:.1f} watts\n"
+            f"• Total readings: {summary['reading_count']}"
+        )
         
-        return {**state, "answer": response, "data": summary}
+        return _answer(state, response, summary)
 
-def handle_device_comparison_query(state: InternalState, parsed_query: Dict[str, Any], db: Session) -> InternalState:
+async def handle_device_comparison_query(state: InternalState, parsed_query: Dict[str, Any], db: AsyncSession) -> InternalState:
     """Handle device comparison queries"""
-    top_consumers = TelemetryService.get_top_consuming_devices(db, state["user_id"], limit=5)
+    top_consumers = await TelemetryService.get_top_consuming_devices(db, state["user_id"], 5)
     
     if not top_consumers:
-        return {**state, "answer": "No energy data available for device comparison."}
+        return _answer(state, "No energy data available for device comparison.")
     
-    response = "Top energy consuming devices:\n"
-    for i, device in enumerate(top_consumers, 1):
-        response += f"{i}. {device['name']} ({device['type']}): {device['average_power_watts']:.1f} watts\n"
+    response = _format_top_consumers("Top energy consuming devices:\n", top_consumers)
     
-    return {**state, "answer": response, "data": {"top_consumers": top_consumers}}
+    return _answer(state, response, {"top_consumers": top_consumers})
 
-def handle_top_consumers_query(state: InternalState, parsed_query: Dict[str, Any], db: Session) -> InternalState:
+async def handle_top_consumers_query(state: InternalState, parsed_query: Dict[str, Any], db: AsyncSession) -> InternalState:
     """Handle top consumers queries"""
     limit = parsed_query.get("limit", 5)
-    top_consumers = TelemetryService.get_top_consuming_devices(db, state["user_id"], limit=limit)
+    top_consumers = await TelemetryService.get_top_consuming_devices(db, state["user_id"], limit)
     
     if not top_consumers:
-        return {**state, "answer": "No energy data available."}
+        return _answer(state, "No energy data available.")
     
-    response = f"Top {len(top_consumers)} energy consuming devices:\n"
-    for i, device in enumerate(top_consumers, 1):
-        response += f"{i}. {device['name']} ({device['type']}): {device['average_power_watts']:.1f} watts\n"
+    response = _format_top_consumers(f"Top {len(top_consumers)} energy consuming devices:\n", top_consumers)
     
-    return {**state, "answer": response, "data": {"top_consumers": top_consumers}}
+    return _answer(state, response, {"top_consumers": top_consumers})
 
-def handle_energy_summary_query(state: InternalState, parsed_query: Dict[str, Any], db: Session) -> InternalState:
+async def handle_energy_summary_query(state: InternalState, parsed_query: Dict[str, Any], db: AsyncSession) -> InternalState:
     """Handle energy summary queries"""
     time_period = parsed_query.get("time_period", "today")
     start_time, end_time = get_time_range(time_period)
     
-    summary = TelemetryService.get_energy_summary(db, state["user_id"], start_time=start_time, end_time=end_time)
+    summary = await TelemetryService.get_energy_summary(
+        db, state["user_id"], start_time=start_time, end_time=end_time
+    )
     
-    response = f"Energy summary ({time_period}):\n"
-    response += f"• Average power: {summary['average_power_watts']:.1f} watts\n"
-    response += f"• Peak power: {summary['max_power_watts']:.1f} watts\n"
-    response += f"• Minimum power: {summary['min_power_watts']:.1f} watts\n"
-    response += f"• Total readings: {summary['reading_count']}"
+    response = (
+        f"Energy summary ({time_period}):\n"
+        f"• Average power: {summary['average_power_watts']:.1f} watts\n"
+        f"• Peak power: {summary['max_power_watts']:.1f} watts\n"
+        f"• Minimum power: {summary['min_power_watts']:.1f} watts\n"
+        f"• Total readings: {summary['reading_count']}"
+    )
     
-    return {**state, "answer": response, "data": summary}
+    return _answer(state, response, summary)
 
-def handle_device_list_query(state: InternalState, db: Session) -> InternalState:
+async def handle_device_list_query(state: InternalState, db: AsyncSession) -> InternalState:
     """Handle device list queries"""
-    devices = DeviceService.get_user_devices(db, state["user_id"])
+    devices = await DeviceService.get_user_devices_lite(db, state["user_id"])
     
     if not devices:
-        return {**state, "answer": "You don't have any devices registered yet."}
+        return _answer(state, "You don't have any devices registered yet.")
     
-    response = "Your registered devices:\n"
-    for i, device in enumerate(devices, 1):
-        status = "Active" if device.is_active else "Inactive"
-        response += f"{i}. {device.name} ({device.device_type}) - {status}\n"
+    response = "Your registered devices:\n" + "".join(
+        f"{i}. {device.name} ({device.device_type}) - {'Active' if device.is_active else 'Inactive'}\n"
+        for i, device in enumerate(devices, 1)
+    )
     
-    return {**state, "answer": response, "data": {"devices": [{"name": d.name, "type": d.device_type, "active": d.is_active} for d in devices]}}
+    return _answer(state, response, {"devices": [{"name": d.name, "type": d.device_type, "active": d.is_active} for d in devices]})
 
 def generate_fallback_response(state: InternalState) -> InternalState:
     """Generate fallback response for unrecognized queries"""
-    response = "I'm not sure I understood your question. I can help you with:\n"
-    response += "• Energy usage for specific devices\n"
-    response += "• Comparing energy consumption between devices\n"
-    response += "• Finding your highest energy consuming devices\n"
-    response += "• Energy usage summaries\n"
-    response += "• Listing your devices"
-    
-    return {**state, "answer": response}
+    return _answer(state, FALLBACK_RESPONSE)
 
 def generate_error_response(state: InternalState) -> InternalState:
     """Generate error response"""
-    response = "Sorry, I encountered an error while processing your request. Please try again or rephrase your question."
-    return {**state, "answer": response}
+    return _answer(state, ERROR_RESPONSE)
 
 # LangGraph nodes
-def classify_intent_node(state: InternalState) -> InternalState:
-    """Classify the intent of the user query using LLM"""
-    intent = classify_intent(state["query"])
-    return {**state, "intent": intent.name}
-
-def parse_query_node(state: InternalState) -> InternalState:
-    """Parse the query to extract parameters using LLM"""
-    intent = QueryIntent[state["intent"]]
-    
-    if intent in [QueryIntent.ENERGY_USAGE, QueryIntent.DEVICE_COMPARISON, QueryIntent.TOP_CONSUMERS, QueryIntent.ENERGY_SUMMARY]:
-        parsed_query = parse_energy_query(state["query"])
-        return {**state, "parsed_query": parsed_query}
-    
-    return state
+async def classify_and_parse_node(state: InternalState) -> InternalState:
+    """Classify the query and extract its parameters using one LLM call"""
+    intent, parsed_query = await classify_and_parse(state["query"])
+    # LangGraph merges the returned keys into the state
+    return {"intent": intent, "parsed_query": parsed_query}
 
 def generate_response_node(state: InternalState) -> InternalState:
     """Generate the final response with database integration"""
     # This will be handled by the main service method with database access
     return state
 
-def validate_user_access_node(state: InternalState) -> InternalState:
-    """Validate user has access to requested data"""
-    return state
-
-def enrich_context_node(state: InternalState) -> InternalState:
-    """Enrich query context with user preferences and history"""
-    # This is a placeholder for future context enrichment
-    return state
-
 # LangGraph setup
 def create_chat_graph() -> StateGraph:
-    """Create the LangGraph for chat processing with enhanced visual structure"""
+    """Create the LangGraph for chat processing
+
+    The model is called once, in classify_and_parse; the answer itself is
+    built by ChatService with database access.
+    """
     workflow = StateGraph(InternalState)
     
-    # Add nodes with detailed descriptions for better visualization
-    workflow.add_node("classify_intent", classify_intent_node)
-    workflow.add_node("validate_user_access", validate_user_access_node)
-    workflow.add_node("enrich_context", enrich_context_node)
-    workflow.add_node("parse_query", parse_query_node)
+    workflow.add_node("classify_and_parse", classify_and_parse_node)
     workflow.add_node("generate_response", generate_response_node)
     
-    # Set entry point
-    workflow.set_entry_point("classify_intent")
-    
-    # Add conditional edges
-    def route_after_classification(state: InternalState):
-        intent = QueryIntent[state["intent"]]
-        if intent in [QueryIntent.GREETING, QueryIntent.THANKS, QueryIntent.GOODBYE, QueryIntent.OFF_TOPIC]:
-            return "generate_response"  # Skip parsing for small talk
-        return "validate_user_access"
-    
-    def route_after_validation(state: InternalState):
-        intent = QueryIntent[state["intent"]]
-        if intent in [QueryIntent.ENERGY_USAGE, QueryIntent.DEVICE_COMPARISON, QueryIntent.TOP_CONSUMERS, QueryIntent.ENERGY_SUMMARY]:
-            return "enrich_context"  # Add context for complex queries
-        return "parse_query"
-    
-    def route_after_enrichment(state: InternalState):
-        return "parse_query"
-    
-    def route_after_parsing(state: InternalState):
-        return "generate_response"
-    
-    # Add conditional edges
-    workflow.add_conditional_edges(
-        "classify_intent",
-        route_after_classification,
-        {
-            "validate_user_access": "validate_user_access",
-            "generate_response": "generate_response"
-        }
-    )
-    
-    workflow.add_conditional_edges(
-        "validate_user_access",
-        route_after_validation,
-        {
-            "enrich_context": "enrich_context",
-            "parse_query": "parse_query"
-        }
-    )
-    
-    workflow.add_conditional_edges(
-        "enrich_context",
-        route_after_enrichment,
-        {
-            "parse_query": "parse_query"
-        }
-    )
-    
-    workflow.add_conditional_edges(
-        "parse_query",
-        route_after_parsing,
-        {
-            "generate_response": "generate_response"
-        }
-    )
-    
-    # Add final edge
+    workflow.set_entry_point("classify_and_parse")
+    workflow.add_edge("classify_and_parse", "generate_response")
     workflow.add_edge("generate_response", END)
     
     return workflow.compile()
 
+# Compiled once per process and shared by every ChatService
+chat_graph = create_chat_graph()
+
 class ChatService:
     """Service for handling conversational AI queries"""
     
     def __init__(self):
-        self.graph = create_chat_graph()
+        self.graph = chat_graph
+        self.cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
     
-    def process_query(self, query: str, user_id: int, db: Session, chat_id: str = None) -> Dict[str, Any]:
-        """Process a natural language query about energy usage"""
+    async def process_query(self, query: str, user_id: int, db_factory, chat_id: str = None) -> Dict[str, Any]:
+        """Process a natural language query about energy usage
+
+        ``db_factory`` opens an async session; it is only called when the
+        classified intent needs data from the database.
+        """
+        new_conversation = not chat_id
         if not chat_id:
-            import uuid
             chat_id = str(uuid.uuid4())
         
         # Prepare initial state
@@ -453,14 +502,71 @@ class ChatService:
             "user_id": user_id
         }
         
-        # Run through the graph
-        graph_result = self.graph.invoke(initial_state)
+        # Run through the graph (LLM calls are awaited, not run on a thread)
+        graph_result = await self.graph.ainvoke(initial_state)
+        
+        # New conversations that need the database are answered from the
+        # semantic cache when the same intent and parameters were answered
+        # from the current data; small talk is already cheap
+        intent = graph_result["intent"]
+        parsed_query = graph_result.get("parsed_query") or {}
+        version = None
+        if new_conversation and self.cache is not None and intent not in SMALL_TALK_INTENTS:
+            version = await get_user_data_version(user_id)
+            cached = self.cache.lookup(user_id, intent, parsed_query, version)
+            if cached:
+                logger.info("Semantic cache hit for user %s: '%s'", user_id, query)
+                return {**cached, "chat_id": chat_id}
         
-        # Generate the actual response with database access
-        final_result = generate_response(graph_result, db)
+        final_result = await self._generate(graph_result, db_factory)
         
-        return {
+        result = {
             "chat_id": chat_id,
             "answer": final_result["answer"],
             "data": final_result.get("data")
-        } 
\ No newline at end of file
+        }
+        # Error answers are not cached, so the next attempt retries
+        if version is not None and result["answer"] != ERROR_RESPONSE:
+            self.cache.store(user_id, intent, parsed_query, version, result)
+        return result
+    
+    async def stream_query(
+        self, query: str, user_id: int, db_factory, chat_id: str = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Process a query, yielding ``(event, payload)`` pairs as each stage completes
+
+        Emits ``intent`` once the query is classified, one ``delta`` per line
+        of the answer, and a final ``done`` with the chat_id and structured data.
+        """
+        if not chat_id:
+            chat_id = str(uuid.uuid4())
+        
+        initial_state = {
+            "chat_id": chat_id,
+            "query": query,
+            "user_id": user_id
+        }
+        
+        graph_result = initial_state
+        async for state in self.graph.astream(initial_state, stream_mode="values"):
+            if "intent" in state and "intent" not in graph_result:
+                yield "intent", {"chat_id": chat_id, "intent": state["intent"].name}
+            graph_result = state
+        
+        final_result = await self._generate(graph_result, db_factory)
+        for line in final_result["answer"].splitlines(keepends=True):
+            yield "delta", {"delta": line}
+        yield "done", {"chat_id": chat_id, "data": final_result.get("data")}
+    
+    async def _generate(self, graph_result: InternalState, db_factory) -> InternalState:
+        """Build the answer for a classified query"""
+        # Small talk needs no database connection
+        if graph_result["intent"] in SMALL_TALK_INTENTS:
+            return generate_small_talk_response(graph_result)
+        async with db_factory() as db:
+            return await generate_response(graph_result, db) 
+
+@lru_cache(maxsize=None)
+def get_chat_service() -> ChatService:
+    """Dependency returning the process-wide ChatService"""
+    return ChatService()
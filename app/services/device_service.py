@@ -1,37 +1,102 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, delete, func, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
-from app.models.device import Device, DeviceCreate, DeviceUpdate, DeviceResponse
+from app.models.device import Device, DeviceCreate, DeviceUpdate, DeviceResponse, DeviceResponseListAdapter
 from app.models.user import User
-from typing import List, Optional
-import uuid
+from app.utils.cache import bump_user_data_version
+from cachetools import TLRUCache, TTLCache
+from typing import List, Optional, Tuple
+from datetime import datetime
+import base64
+import hashlib
+import os
+import random
+from uuid import UUID, uuid4
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Devices read recently in this process, keyed by (user_id, device_id), so a
+# detail read right after a list read skips its SELECT. Writes drop the entry.
+# Lifetimes are jittered by +/-20% so a page of devices cached together does
+# not expire in the same instant.
+DEVICE_CACHE_TTL = int(os.getenv("DEVICE_CACHE_TTL_SECONDS", "5"))
+
+def _device_ttu(_key, _value, now: float) -> float:
+    return now + DEVICE_CACHE_TTL * random.uniform(0.8, 1.2)
+
+_device_cache = TLRUCache(maxsize=10000, ttu=_device_ttu)
+
+# Internal id and owner per device UUID, for the telemetry ingest path. These
+# never change while the device exists; delete_device drops the entry here
+# and copies held by other workers expire after the TTL.
+DEVICE_KEY_CACHE_TTL = int(os.getenv("DEVICE_KEY_CACHE_TTL_SECONDS", "300"))
+_device_keys = TTLCache(maxsize=10000, ttl=DEVICE_KEY_CACHE_TTL)
+
+def encode_cursor(created_at: datetime, device_pk: int) -> str:
+    """Opaque pagination cursor for the device after which the next page starts"""
+    raw = f"{created_at.isoformat()}|{device_pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        created_at, device_pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(device_pk)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+def _session_device_lists(db: AsyncSession) -> dict:
+    """Device lists already read through this session, keyed by (kind, user_id)
+
+    A session lives for one API request (see the db_session middleware) or
+    one chat turn, so repeated list reads within it share one SELECT.
+    """
+    return db.info.setdefault("user_devices", {})
+
+def _forget_device_lists(db: AsyncSession, user_id: int) -> None:
+    lists = db.info.get("user_devices")
+    if lists:
+        lists.pop(("full", user_id), None)
+        lists.pop(("lite", user_id), None)
+
+def _device_values(device_data: DeviceCreate, user_id: int) -> dict:
+    """Column values for a new device; generates a UUID when none is provided"""
+    return {
+        "device_id": device_data.device_id or uuid4(),
+        "name": device_data.name,
+        "device_type": device_data.device_type,
+        "user_id": user_id
+    }
+
 class DeviceService:
     
     @staticmethod
-    def create_device(db: Session, device_data: DeviceCreate, user_id: int) -> DeviceResponse:
-        """Create a new device for a user"""
-        # Use provided device_id or generate a unique device ID (UUID)
-        device_uuid = device_data.device_id if device_data.device_id else str(uuid.uuid4())
-        
-        # Create device
-        db_device = Device(
-            device_id=device_uuid,
-            name=device_data.name,
-            device_type=device_data.device_type,
-            user_id=user_id
-        )
-        
+    async def create_device(db: AsyncSession, device_data: DeviceCreate, user_id: int) -> DeviceResponse:
+        """Create a new device for a user
+
+        INSERT ... RETURNING hands back the server-generated columns, so
+        there is no refresh round trip after the commit.
+        """
         try:
-            db.add(db_device)
-            db.commit()
-            db.refresh(db_device)
+            result = await db.execute(
+                insert(Device).values(**_device_values(device_data, user_id)).returning(Device)
+            )
+            response = DeviceResponse.model_validate(result.scalar_one())
+            await db.commit()
+            _forget_device_lists(db, user_id)
+            await bump_user_data_version(user_id)
             logger.info(f"Device created: {device_data.name} for user {user_id}")
-            return DeviceResponse.from_orm(db_device)
+            return response
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Device with ID {device_data.device_id} already exists"
+            )
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Error creating device: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -39,58 +104,215 @@ class DeviceService:
             )
     
     @staticmethod
-    def get_user_devices(db: Session, user_id: int) -> List[DeviceResponse]:
+    async def create_devices_bulk(db: AsyncSession, user_id: int, devices: List[DeviceCreate]) -> List[DeviceResponse]:
+        """Create several devices for a user with one multi-row INSERT ... RETURNING"""
+        if not devices:
+            return []
+        try:
+            result = await db.scalars(
+                insert(Device).returning(Device),
+                [_device_values(device_data, user_id) for device_data in devices]
+            )
+            response = DeviceResponseListAdapter.validate_python(result.all(), from_attributes=True)
+            await db.commit()
+            _forget_device_lists(db, user_id)
+            await bump_user_data_version(user_id)
+            logger.info(f"Created {len(response)} devices for user {user_id}")
+            return response
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error creating devices: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error creating devices"
+            )
+    
+    @staticmethod
+    async def get_user_devices(db: AsyncSession, user_id: int) -> List[DeviceResponse]:
         """Get all devices for a user"""
-        devices = db.query(Device).filter(Device.user_id == user_id).all()
-        return [DeviceResponse.from_orm(device) for device in devices]
+        lists = _session_device_lists(db)
+        cached = lists.get(("full", user_id))
+        if cached is not None:
+            return cached
+        
+        result = await db.execute(select(Device).where(Device.user_id == user_id))
+        devices = result.scalars().all()
+        response = DeviceResponseListAdapter.validate_python(devices, from_attributes=True)
+        lists[("full", user_id)] = response
+        return response
     
     @staticmethod
-    def get_device_by_id(db: Session, device_id: str, user_id: int) -> Optional[DeviceResponse]:
+    async def get_user_devices_lite(db: AsyncSession, user_id: int) -> List[Row]:
+        """Get a user's devices as plain rows (device_id, name, device_type, is_active)
+
+        For internal callers that only read a few columns; skips ORM
+        hydration and response-model validation.
+        """
+        lists = _session_device_lists(db)
+        cached = lists.get(("lite", user_id))
+        if cached is not None:
+            return cached
+        
+        result = await db.execute(
+            select(Device.device_id, Device.name, Device.device_type, Device.is_active)
+            .where(Device.user_id == user_id)
+        )
+        rows = result.all()
+        lists[("lite", user_id)] = rows
+        return rows
+    
+    @staticmethod
+    async def get_user_devices_page(
+        db: AsyncSession,
+        user_id: int,
+        limit: int,
+        after: Optional[str] = None
+    ) -> Tuple[List[DeviceResponse], Optional[str]]:
+        """Get one page of a user's devices, newest first, plus the cursor of the next page"""
+        query = select(Device).where(Device.user_id == user_id)
+        if after:
+            try:
+                cursor_created_at, cursor_pk = decode_cursor(after)
+            except ValueError:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid pagination cursor"
+                )
+            query = query.where(tuple_(Device.created_at, Device.id) < (cursor_created_at, cursor_pk))
+        
+        # Fetch one extra row to learn whether another page exists
+        result = await db.execute(
+            query.order_by(Device.created_at.desc(), Device.id.desc()).limit(limit + 1)
+        )
+        devices = result.scalars().all()
+        
+        next_cursor = None
+        if len(devices) > limit:
+            devices = devices[:limit]
+            next_cursor = encode_cursor(devices[-1].created_at, devices[-1].id)
+        
+        page = DeviceResponseListAdapter.validate_python(devices, from_attributes=True)
+        for device in page:
+            _device_cache[(user_id, device.device_id)] = device
+        return page, next_cursor
+    
+    @staticmethod
+    async def get_devices_etag(db: AsyncSession, user_id: int, *page_key) -> str:
+        """ETag for a user's device list, derived from an index-only aggregate
+
+        Any create, update or delete changes the row count or the newest
+        timestamp, so the tag changes whenever the list would.
+        """
+        result = await db.execute(
+            select(func.count(Device.id), func.max(func.coalesce(Device.updated_at, Device.created_at)))
+            .where(Device.user_id == user_id)
+        )
+        count, last_modified = result.one()
+        raw = f"{user_id}:{count}:{last_modified}:{page_key}"
+        return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+    
+    @staticmethod
+    async def resolve_device_key(db: AsyncSession, device_id: UUID) -> Optional[Tuple[int, int]]:
+        """Internal id and owner id of a device by its public UUID, or None if unknown"""
+        cached = _device_keys.get(device_id)
+        if cached is not None:
+            return cached
+        
+        result = await db.execute(
+            select(Device.id, Device.user_id).where(Device.device_id == device_id)
+        )
+        row = result.first()
+        if row is None:
+            return None
+        _device_keys[device_id] = (row.id, row.user_id)
+        return _device_keys[device_id]
+    
+    @staticmethod
+    def forget_device_key(device_id: UUID) -> None:
+        """Drop a cached device key, e.g. after an insert found the device gone"""
+        _device_keys.pop(device_id, None)
+    
+    @staticmethod
+    async def get_device_by_name(db: AsyncSession, user_id: int, name: str) -> Optional[DeviceResponse]:
+        """Get a user's device by name, ignoring case"""
+        result = await db.execute(
+            select(Device).where(
+                Device.user_id == user_id,
+                func.lower(Device.name) == name.lower()
+            ).limit(1)
+        )
+        device = result.scalars().first()
+        return DeviceResponse.model_validate(device) if device else None
+    
+    @staticmethod
+    async def get_device_by_id(db: AsyncSession, device_id: UUID, user_id: int) -> Optional[DeviceResponse]:
         """Get a specific device by ID for a user"""
-        device = db.query(Device).filter(
-            Device.device_id == device_id,
-            Device.user_id == user_id
-        ).first()
+        cached = _device_cache.get((user_id, device_id))
+        if cached is not None:
+            return cached
+        
+        result = await db.execute(
+            select(Device).where(
+                Device.device_id == device_id,
+                Device.user_id == user_id
+            )
+        )
+        device = result.scalars().first()
         
         if not device:
             return None
         
-        return DeviceResponse.from_orm(device)
+        response = DeviceResponse.model_validate(device)
+        _device_cache[(user_id, device_id)] = response
+        return response
     
     @staticmethod
-    def update_device(
-        db: Session, 
-        device_id: str, 
+    async def update_device(
+        db: AsyncSession, 
+        device_id: UUID, 
         device_data: DeviceUpdate, 
         user_id: int
     ) -> DeviceResponse:
-        """Update a device"""
-        device = db.query(Device).filter(
-            Device.device_id == device_id,
-            Device.user_id == user_id
-        ).first()
-        
-        if not device:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Device not found or access denied"
-            )
-        
-        # Update fields
-        if device_data.name is not None:
-            device.name = device_data.name
-        if device_data.device_type is not None:
-            device.device_type = device_data.device_type
-        if device_data.is_active is not None:
-            device.is_active = device_data.is_active
+        """Update a device
+
+        Ownership check and update run as one UPDATE ... RETURNING, so there
+        is a single round-trip and no gap between the check and the write.
+        """
+        values = device_data.model_dump(exclude_none=True)
+        if not values:
+            device = await DeviceService.get_device_by_id(db, device_id, user_id)
+            if not device:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Device not found or access denied"
+                )
+            return device
         
         try:
-            db.commit()
-            db.refresh(device)
+            result = await db.execute(
+                update(Device)
+                .where(Device.device_id == device_id, Device.user_id == user_id)
+                .values(**values)
+                .returning(Device)
+            )
+            device = result.scalars().first()
+            if not device:
+                await db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Device not found or access denied"
+                )
+            response = DeviceResponse.model_validate(device)
+            await db.commit()
+            _device_cache.pop((user_id, device_id), None)
+            _forget_device_lists(db, user_id)
+            await bump_user_data_version(user_id)
             logger.info(f"Device updated: {device_id}")
-            return DeviceResponse.from_orm(device)
+            return response
+        except HTTPException:
+            raise
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Error updating device: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -98,29 +320,33 @@ class DeviceService:
             )
     
     @staticmethod
-    def delete_device(db: Session, device_id: str, user_id: int) -> bool:
-        """Delete a device"""
-        device = db.query(Device).filter(
-            Device.device_id == device_id,
-            Device.user_id == user_id
-        ).first()
-        
-        if not device:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Device not found or access denied"
-            )
-        
+    async def delete_device(db: AsyncSession, device_id: UUID, user_id: int) -> bool:
+        """Delete a device with a single DELETE ... RETURNING"""
         try:
-            db.delete(device)
-            db.commit()
+            result = await db.execute(
+                delete(Device)
+                .where(Device.device_id == device_id, Device.user_id == user_id)
+                .returning(Device.id)
+            )
+            if result.scalar_one_or_none() is None:
+                await db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Device not found or access denied"
+                )
+            await db.commit()
+            _device_cache.pop((user_id, device_id), None)
+            _device_keys.pop(device_id, None)
+            _forget_device_lists(db, user_id)
+            await bump_user_data_version(user_id)
             logger.info(f"Device deleted: {device_id}")
             return True
+        except HTTPException:
+            raise
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Error deleting device: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Error deleting device"
             )
-        
\ No newline at end of file
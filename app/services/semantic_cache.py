@@ -0,0 +1,39 @@
+from typing import Dict, Any, Optional, Hashable, Tuple
+from cachetools import TTLCache
+import orjson
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+# Answers include live energy data, so entries expire quickly
+CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "300"))
+MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+
+class SemanticCache:
+    """Cache of chat answers keyed by what the query means rather than its text
+
+    Paraphrases that classify to the same intent and parameters share an
+    answer, e.g. "energy today" and "how much power did I use today".
+    Entries are keyed by the user's data version as well, so new telemetry
+    or device changes retire them like the exact-match cache.
+    """
+
+    def __init__(self):
+        # One bounded cache for all users, so idle users age out with
+        # their entries
+        self._entries: TTLCache = TTLCache(maxsize=MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+
+    @staticmethod
+    def _key(user_id: int, intent: Hashable, parsed_query: Dict[str, Any], version: int) -> Tuple:
+        # Sorted keys so equal parameters give the same key in any order
+        return user_id, intent, orjson.dumps(parsed_query, option=orjson.OPT_SORT_KEYS), version
+
+    def lookup(self, user_id: int, intent: Hashable, parsed_query: Dict[str, Any], version: int) -> Optional[Dict[str, Any]]:
+        """Return the cached response for the classified query, if any"""
+        return self._entries.get(self._key(user_id, intent, parsed_query, version))
+
+    def store(self, user_id: int, intent: Hashable, parsed_query: Dict[str, Any], version: int, response: Dict[str, Any]) -> None:
+        """Cache a response for the classified query and data version"""
+        self._entries[self._key(user_id, intent, parsed_query, version)] = response
@@ -0,0 +1,100 @@
+from typing import List, Optional
+import asyncio
+import logging
+import os
+from app.models.telemetry import TelemetryCreate
+from app.services.telemetry_service import TelemetryService
+from app.utils.db import get_async_db_context
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_ROWS = int(os.getenv("TELEMETRY_BUFFER_MAX_ROWS", "500"))
+MAX_WAIT_SECONDS = int(os.getenv("TELEMETRY_BUFFER_MAX_WAIT_MS", "200")) / 1000
+MAX_PENDING = int(os.getenv("TELEMETRY_BUFFER_MAX_PENDING", "20000"))
+
+# Queued by stop(): the worker flushes what it holds and exits
+_STOP = object()
+
+class TelemetryBuffer:
+    """Collects single readings from clients that cannot batch and writes them in bulk.
+
+    Readings are flushed with one INSERT once MAX_ROWS are waiting or
+    MAX_WAIT_SECONDS after the first of them arrived, whichever comes first.
+    Buffered readings are acknowledged before they are written, so a crash
+    can lose up to one flush worth of data; a graceful stop drains the
+    buffer first.
+    """
+
+    def __init__(self, max_rows: int = MAX_ROWS, max_wait: float = MAX_WAIT_SECONDS):
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the background flusher on the running event loop"""
+        if self._worker is None:
+            # bounded so a stalled database applies backpressure to producers
+            self._queue = asyncio.Queue(maxsize=MAX_PENDING)
+            self._worker = asyncio.create_task(self._run())
+            logger.info("Telemetry buffer started (max_rows=%s, max_wait=%ss)", self.max_rows, self.max_wait)
+
+    async def stop(self):
+        """Stop the flusher, writing out everything already accepted"""
+        if self._worker is None:
+            return
+        worker, self._worker = self._worker, None
+        # Readings ahead of the marker, including the worker's current
+        # batch, are flushed before it exits
+        await self._queue.put(_STOP)
+        await worker
+        # Readings submitted while the marker was queued
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if pending:
+            await self._flush(pending)
+
+    async def submit(self, reading: TelemetryCreate) -> None:
+        """Queue a reading for the next bulk insert"""
+        if self._worker is None:
+            await self._flush([reading])
+            return
+        await self._queue.put(reading)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            reading = await self._queue.get()
+            if reading is _STOP:
+                return
+            batch = [reading]
+            stopping = False
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    reading = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if reading is _STOP:
+                    stopping = True
+                    break
+                batch.append(reading)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[TelemetryCreate]):
+        try:
+            async with get_async_db_context() as db:
+                await TelemetryService.ingest_telemetry_bulk(db, batch, skip_unknown=True)
+        except Exception as e:
+            logger.error("Failed to flush %s buffered telemetry readings: %s", len(batch), e)
+
+telemetry_buffer = TelemetryBuffer()
@@ -1,44 +1,119 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import select, func, and_, text, true
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
-from app.models.telemetry import Telemetry, TelemetryCreate, TelemetryQuery
+from app.models.telemetry import Telemetry, TelemetryCreate, TelemetryQuery, telemetry_hourly
 from app.models.device import Device
+from app.services.device_service import DeviceService
 from app.models.user import User
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from app.utils.cache import bump_user_data_version, cached_telemetry
+from app.utils.db import get_async_db_context
+from typing import AsyncIterator, List, NamedTuple, Optional, Dict, Any
+from uuid import UUID
+from datetime import datetime, timedelta, timezone
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Latest readings returned per device by /api/telemetry/my-devices
+MY_DEVICES_READINGS_LIMIT = int(os.getenv("MY_DEVICES_READINGS_LIMIT", "100"))
+
+# Column order of the records written by ingest_telemetry_bulk
+TELEMETRY_COPY_COLUMNS = ["device_id", "device_uuid", "timestamp", "energy_watts"]
+
+class AggregateSource(NamedTuple):
+    """Table and aggregate expressions behind the summary and ranking queries"""
+    table: Any
+    device_id: Any
+    reading_count: Any
+    total: Any
+    average: Any
+    maximum: Any
+    minimum: Any
+    filters: List[Any]
+
+# Whether the telemetry_hourly rollup exists; looked up once per process
+_hourly_rollup: Optional[bool] = None
+
+async def _hourly_rollup_available(db: AsyncSession) -> bool:
+    global _hourly_rollup
+    if _hourly_rollup is None:
+        result = await db.execute(text("SELECT to_regclass('telemetry_hourly') IS NOT NULL"))
+        _hourly_rollup = bool(result.scalar())
+    return _hourly_rollup
+
+def _is_hour_aligned(ts: datetime) -> bool:
+    return ts.minute == 0 and ts.second == 0 and ts.microsecond == 0
+
+def _window_fits_hours(start_time: Optional[datetime], end_time: Optional[datetime]) -> bool:
+    """Whether hourly buckets cover [start_time, end_time] without partial hours"""
+    if start_time and not _is_hour_aligned(start_time):
+        return False
+    if end_time and not _is_hour_aligned(end_time):
+        # an unaligned end is fine only when it is "now": nothing later exists yet
+        now = datetime.now(timezone.utc) if end_time.tzinfo else datetime.utcnow()
+        return end_time >= now - timedelta(seconds=5)
+    return True
+
 class TelemetryService:
     
     @staticmethod
-    def ingest_telemetry(db: Session, telemetry_data: TelemetryCreate) -> Telemetry:
-        """Ingest telemetry data for a device"""
-        # Find the device by device_id (UUID string)
-        device = db.query(Device).filter(Device.device_id == telemetry_data.device_id).first()
+    async def _get_owned_device(db: AsyncSession, device_id: UUID, user_id: int) -> Device:
+        """Find a device by its public UUID, verifying the user owns it"""
+        result = await db.execute(
+            select(Device).where(
+                Device.device_id == device_id,
+                Device.user_id == user_id
+            )
+        )
+        device = result.scalars().first()
         
         if not device:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Device not found or access denied"
+            )
+        return device
+    
+    @staticmethod
+    async def ingest_telemetry(db: AsyncSession, telemetry_data: TelemetryCreate) -> Telemetry:
+        """Ingest telemetry data for a device"""
+        # Find the device by its public UUID (cached per process)
+        device_key = await DeviceService.resolve_device_key(db, telemetry_data.device_id)
+        
+        if device_key is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Device with ID {telemetry_data.device_id} not found"
             )
         
+        device_pk, owner_id = device_key
+        
         # Create telemetry record
         db_telemetry = Telemetry(
-            device_id=device.id,  # Use the internal device ID
+            device_id=device_pk,  # Use the internal device ID
+            device_uuid=telemetry_data.device_id,
             timestamp=telemetry_data.timestamp,
             energy_watts=telemetry_data.energy_watts
         )
         
         try:
             db.add(db_telemetry)
-            db.commit()
-            db.refresh(db_telemetry)
+            await db.commit()
+            await bump_user_data_version(owner_id)
             logger.info(f"Telemetry ingested for device {telemetry_data.device_id}: {telemetry_data.energy_watts}W")
             return db_telemetry
+        except IntegrityError:
+            # A cached key for a device deleted through another worker
+            await db.rollback()
+            DeviceService.forget_device_key(telemetry_data.device_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Device with ID {telemetry_data.device_id} not found"
+            )
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Error ingesting telemetry: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -46,133 +121,296 @@ class TelemetryService:
             )
     
     @staticmethod
-    def get_telemetry_by_device(
-        db: Session, 
-        device_id: str, 
-        user_id: int,
-        start_time: Optional[datetime] = None,
-        end_time: Optional[datetime] = None,
-        limit: int = 100
-    ) -> List[Telemetry]:
-        """Get telemetry data for a specific device owned by the user"""
-        # Find the device and verify ownership
-        device = db.query(Device).filter(
-            and_(
-                Device.device_id == device_id,
-                Device.user_id == user_id
-            )
-        ).first()
+    async def ingest_telemetry_bulk(
+        db: AsyncSession,
+        telemetry_items: List[TelemetryCreate],
+        skip_unknown: bool = False
+    ) -> int:
+        """Ingest many telemetry readings with a single binary COPY
+
+        Readings for unknown devices fail the whole batch with a 404, or are
+        dropped when skip_unknown is set.
+        """
+        device_uuids = {item.device_id for item in telemetry_items}
+        result = await db.execute(
+            select(Device.device_id, Device.id, Device.user_id).where(Device.device_id.in_(device_uuids))
+        )
+        owners = {}
+        devices = {}
+        for device_uuid, device_pk, owner_id in result.all():
+            devices[device_uuid] = device_pk
+            owners[device_uuid] = owner_id
         
-        if not device:
+        missing = device_uuids - devices.keys()
+        if missing and skip_unknown:
+            logger.warning(f"Dropping telemetry for unknown devices: {', '.join(str(d) for d in missing)}")
+            telemetry_items = [item for item in telemetry_items if item.device_id in devices]
+            if not telemetry_items:
+                return 0
+        elif missing:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="Device not found or access denied"
+                detail=f"Devices not found: {', '.join(str(d) for d in sorted(missing))}"
             )
         
-        # Build query
-        query = db.query(Telemetry).filter(Telemetry.device_id == device.id)
+        records = [
+            (devices[item.device_id], item.device_id, item.timestamp, item.energy_watts)
+            for item in telemetry_items
+        ]
+        
+        try:
+            # COPY FROM STDIN (binary) on the session's asyncpg connection, inside
+            # the transaction opened by the lookup above; ids and created_at
+            # come from the column defaults
+            conn = await db.connection()
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                Telemetry.__tablename__, records=records, columns=TELEMETRY_COPY_COLUMNS
+            )
+            await db.commit()
+            await bump_user_data_version(*{owners[item.device_id] for item in telemetry_items})
+            logger.info(f"Bulk ingested {len(records)} telemetry readings")
+            return len(records)
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error bulk ingesting telemetry: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error saving telemetry data"
+            )
+    
+    @staticmethod
+    async def get_telemetry_by_device(
+        db: AsyncSession, 
+        device_id: UUID, 
+        user_id: int,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        limit: int = 100,
+        before: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """Get telemetry data for a specific device owned by the user
+
+        Returns plain dicts shaped like TelemetryResponse, read from the
+        same column query the streaming endpoint uses, so no ORM objects
+        are hydrated.
+        """
+        query = await TelemetryService.get_telemetry_stream_query(
+            db, device_id, user_id, start_time, end_time, limit, before
+        )
+        result = await db.execute(query)
+        return [dict(row) for row in result.mappings()]
+    
+    @staticmethod
+    async def get_telemetry_stream_query(
+        db: AsyncSession,
+        device_id: UUID,
+        user_id: int,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        limit: int = 100,
+        before: Optional[datetime] = None
+    ):
+        """Verify ownership and build the column query streamed by stream_rows
+
+        Columns are labelled like TelemetryResponse, so rows serialize to
+        the same JSON without building ORM objects or Pydantic models.
+        ``before`` is a keyset cursor: older pages seek on the
+        (device_id, timestamp DESC) index instead of skipping rows.
+        """
+        device = await TelemetryService._get_owned_device(db, device_id, user_id)
+        
+        query = select(
+            Telemetry.id,
+            Telemetry.device_uuid.label("device_id"),
+            Telemetry.timestamp,
+            Telemetry.energy_watts,
+            Telemetry.created_at
+        ).where(Telemetry.device_id == device.id)
         
         if start_time:
-            query = query.filter(Telemetry.timestamp >= start_time)
+            query = query.where(Telemetry.timestamp >= start_time)
         if end_time:
-            query = query.filter(Telemetry.timestamp <= end_time)
-        
-        # Order by timestamp and limit results
-        telemetry_data = query.order_by(Telemetry.timestamp.desc()).limit(limit).all()
+            query = query.where(Telemetry.timestamp <= end_time)
+        if before:
+            query = query.where(Telemetry.timestamp < before)
         
-        return telemetry_data
+        return query.order_by(Telemetry.timestamp.desc()).limit(limit)
+    
+    @staticmethod
+    async def stream_rows(query, batch_size: int = 200) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield the query's rows as dicts, batch_size at a time
+
+        Uses its own session because a streamed response outlives the
+        request's session.
+        """
+        async with get_async_db_context() as db:
+            result = await db.stream(query.execution_options(yield_per=batch_size))
+            async for partition in result.mappings().partitions():
+                yield [dict(row) for row in partition]
     
     @staticmethod
-    def get_user_devices_telemetry(
-        db: Session,
+    @cached_telemetry("my-devices")
+    async def get_user_devices_telemetry(
+        db: AsyncSession,
         user_id: int,
         start_time: Optional[datetime] = None,
-        end_time: Optional[datetime] = None
+        end_time: Optional[datetime] = None,
+        readings_limit: int = MY_DEVICES_READINGS_LIMIT
     ) -> List[Dict[str, Any]]:
-        """Get telemetry data for all devices owned by a user"""
-        # Get all devices for the user
-        devices = db.query(Device).filter(Device.user_id == user_id).all()
+        """Get telemetry data for all devices owned by a user
+
+        Counts are computed in the database, and ``telemetry_data`` holds
+        only the latest ``readings_limit`` readings of each device (one
+        LATERAL index seek per device), so two queries replace loading
+        every reading in the period. ``truncated`` tells the caller when
+        a device had more readings than were returned.
+        """
+        filters = []
+        if start_time:
+            filters.append(Telemetry.timestamp >= start_time)
+        if end_time:
+            filters.append(Telemetry.timestamp <= end_time)
         
+        # Time filters go in the join so devices without readings still appear
+        counts = await db.execute(
+            select(
+                Device.id,
+                Device.device_id,
+                Device.name,
+                Device.device_type,
+                func.count(Telemetry.id).label('telemetry_count')
+            )
+            .select_from(Device)
+            .outerjoin(Telemetry, and_(Telemetry.device_id == Device.id, *filters))
+            .where(Device.user_id == user_id)
+            .group_by(Device.id)
+            .order_by(Device.id)
+        )
+        devices = counts.all()
         if not devices:
             return []
         
-        device_ids = [device.id for device in devices]
-        
-        # Build query for all user's devices
-        query = db.query(Telemetry).filter(Telemetry.device_id.in_(device_ids))
-        
-        if start_time:
-            query = query.filter(Telemetry.timestamp >= start_time)
-        if end_time:
-            query = query.filter(Telemetry.timestamp <= end_time)
-        
-        telemetry_data = query.order_by(Telemetry.timestamp.desc()).all()
+        latest = (
+            select(
+                Telemetry.id,
+                Telemetry.device_uuid.label("device_id"),
+                Telemetry.timestamp,
+                Telemetry.energy_watts,
+                Telemetry.created_at
+            )
+            .where(Telemetry.device_id == Device.id, *filters)
+            .order_by(Telemetry.timestamp.desc())
+            .limit(readings_limit)
+            .lateral()
+        )
+        readings = await db.execute(
+            select(Device.id.label("device_pk"), latest)
+            .select_from(Device)
+            .join(latest, true())
+            .where(Device.user_id == user_id)
+        )
+        telemetry_by_device: Dict[int, List[Dict[str, Any]]] = {device.id: [] for device in devices}
+        for row in readings.mappings():
+            reading = dict(row)
+            telemetry_by_device[reading.pop("device_pk")].append(reading)
         
-        # Group by device
-        result = []
-        for device in devices:
-            device_telemetry = [t for t in telemetry_data if t.device_id == device.id]
-            result.append({
+        return [
+            {
                 "device_id": device.device_id,
                 "device_name": device.name,
                 "device_type": device.device_type,
-                "telemetry_count": len(device_telemetry),
-                "telemetry_data": device_telemetry
-            })
+                "telemetry_count": device.telemetry_count,
+                "telemetry_data": telemetry_by_device[device.id],
+                "truncated": device.telemetry_count > len(telemetry_by_device[device.id])
+            }
+            for device in devices
+        ]
+    
+    @staticmethod
+    async def _aggregate_source(
+        db: AsyncSession,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime]
+    ) -> AggregateSource:
+        """Pick what the summary and ranking queries aggregate over
+
+        The hourly rollup is used when its buckets cover exactly the
+        requested window; otherwise the raw readings are scanned.
+        """
+        if await _hourly_rollup_available(db) and _window_fits_hours(start_time, end_time):
+            rollup = telemetry_hourly.c
+            filters = []
+            if start_time:
+                filters.append(rollup.hour >= start_time)
+            if end_time:
+                # an aligned end excludes its own bucket; "up to now" includes the current one
+                filters.append(rollup.hour < end_time if _is_hour_aligned(end_time) else rollup.hour <= end_time)
+            reading_count = func.sum(rollup.reading_count)
+            return AggregateSource(
+                table=telemetry_hourly,
+                device_id=rollup.device_id,
+                reading_count=reading_count,
+                total=func.sum(rollup.sum_watts),
+                average=func.sum(rollup.sum_watts) / func.nullif(reading_count, 0),
+                maximum=func.max(rollup.max_watts),
+                minimum=func.min(rollup.min_watts),
+                filters=filters
+            )
         
-        return result
+        filters = []
+        if start_time:
+            filters.append(Telemetry.timestamp >= start_time)
+        if end_time:
+            filters.append(Telemetry.timestamp <= end_time)
+        return AggregateSource(
+            table=Telemetry.__table__,
+            device_id=Telemetry.device_id,
+            reading_count=func.count(Telemetry.id),
+            total=func.sum(Telemetry.energy_watts),
+            average=func.avg(Telemetry.energy_watts),
+            maximum=func.max(Telemetry.energy_watts),
+            minimum=func.min(Telemetry.energy_watts),
+            filters=filters
+        )
     
     @staticmethod
-    def get_energy_summary(
-        db: Session,
+    @cached_telemetry("summary")
+    async def get_energy_summary(
+        db: AsyncSession,
         user_id: int,
-        device_id: Optional[str] = None,
+        device_id: Optional[UUID] = None,
         start_time: Optional[datetime] = None,
         end_time: Optional[datetime] = None
     ) -> Dict[str, Any]:
         """Get energy usage summary for devices"""
+        source = await TelemetryService._aggregate_source(db, start_time, end_time)
+        query = select(
+            source.reading_count.label('reading_count'),
+            source.average.label('average_power'),
+            source.maximum.label('max_power'),
+            source.minimum.label('min_power')
+        ).select_from(source.table).where(*source.filters)
+        
         # Build base query
         if device_id:
             # Specific device
-            device = db.query(Device).filter(
-                and_(
-                    Device.device_id == device_id,
-                    Device.user_id == user_id
-                )
-            ).first()
-            
-            if not device:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Device not found or access denied"
-                )
-            
-            query = db.query(Telemetry).filter(Telemetry.device_id == device.id)
+            device = await TelemetryService._get_owned_device(db, device_id, user_id)
+            query = query.where(source.device_id == device.id)
         else:
             # All user devices
-            devices = db.query(Device).filter(Device.user_id == user_id).all()
-            if not devices:
+            result = await db.execute(select(Device.id).where(Device.user_id == user_id))
+            device_ids = result.scalars().all()
+            if not device_ids:
                 return {"total_energy": 0, "average_power": 0, "device_count": 0}
             
-            device_ids = [device.id for device in devices]
-            query = db.query(Telemetry).filter(Telemetry.device_id.in_(device_ids))
-        
-        # Apply time filters
-        if start_time:
-            query = query.filter(Telemetry.timestamp >= start_time)
-        if end_time:
-            query = query.filter(Telemetry.timestamp <= end_time)
+            query = query.where(source.device_id.in_(device_ids))
         
         # Calculate aggregates
-        result = query.with_entities(
-            func.count(Telemetry.id).label('reading_count'),
-            func.avg(Telemetry.energy_watts).label('average_power'),
-            func.max(Telemetry.energy_watts).label('max_power'),
-            func.min(Telemetry.energy_watts).label('min_power')
-        ).first()
+        result = (await db.execute(query)).first()
         
         return {
-            "reading_count": result.reading_count or 0,
+            "reading_count": int(result.reading_count or 0),
             "average_power_watts": float(result.average_power or 0),
             "max_power_watts": float(result.max_power or 0),
             "min_power_watts": float(result.min_power or 0),
@@ -180,38 +418,40 @@ class TelemetryService:
         }
     
     @staticmethod
-    def get_top_consuming_devices(
-        db: Session,
+    @cached_telemetry("top-consuming")
+    async def get_top_consuming_devices(
+        db: AsyncSession,
         user_id: int,
         limit: int = 3,
         start_time: Optional[datetime] = None,
         end_time: Optional[datetime] = None
     ) -> List[Dict[str, Any]]:
         """Get top energy consuming devices for a user"""
-        # Get user's devices with average power consumption
-        query = db.query(
+        source = await TelemetryService._aggregate_source(db, start_time, end_time)
+        
+        # Get user's devices with average power consumption; the window sum
+        # runs before LIMIT, so shares are relative to all of the user's devices
+        average_power = source.average.label('average_power')
+        query = select(
             Device.device_id,
             Device.name,
             Device.device_type,
-            func.avg(Telemetry.energy_watts).label('average_power')
-        ).join(Telemetry, Device.id == Telemetry.device_id).filter(Device.user_id == user_id)
-        
-        if start_time:
-            query = query.filter(Telemetry.timestamp >= start_time)
-        if end_time:
-            query = query.filter(Telemetry.timestamp <= end_time)
+            average_power,
+            (source.total * 100.0 / func.nullif(func.sum(source.total).over(), 0)).label('percentage_of_total')
+        ).join(source.table, Device.id == source.device_id).where(Device.user_id == user_id, *source.filters)
         
         # Group by device and order by average power
-        devices = query.group_by(Device.id).order_by(
-            func.avg(Telemetry.energy_watts).desc()
-        ).limit(limit).all()
+        result = await db.execute(
+            query.group_by(Device.id).order_by(average_power.desc()).limit(limit)
+        )
         
         return [
             {
                 "device_id": device.device_id,
                 "name": device.name,
                 "type": device.device_type,
-                "average_power_watts": float(device.average_power or 0)
+                "average_power_watts": float(device.average_power or 0),
+                "percentage_of_total": round(float(device.percentage_of_total or 0), 2)
             }
-            for device in devices
-        ] 
\ No newline at end of file
+            for device in result.all()
+        ]
@@ -0,0 +1,102 @@
+from cachetools import TTLCache
+from collections import defaultdict
+from functools import wraps
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+import logging
+import orjson
+import os
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Shared cache backend; without REDIS_URL every worker keeps its own
+# in-process caches instead
+REDIS_URL = os.getenv("REDIS_URL")
+redis_client = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+
+# Exact-match cache of chat answers, keyed by user, normalized query,
+# chat_id and the user's data version
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL_SECONDS", "300"))
+chat_answer_cache = TTLCache(maxsize=10000, ttl=CHAT_CACHE_TTL)
+
+# Aggregated telemetry results (summaries, rankings) cached per data version
+TELEMETRY_CACHE_TTL = int(os.getenv("TELEMETRY_CACHE_TTL_SECONDS", "60"))
+_telemetry_cache = TTLCache(maxsize=10000, ttl=TELEMETRY_CACHE_TTL)
+
+# Per-user counter bumped whenever the user's devices or telemetry change,
+# so cached answers computed from older data are never served again. Lives
+# in Redis when configured so a bump in one worker is seen by all of them.
+_user_data_versions = defaultdict(int)
+_versions_lock = threading.Lock()
+
+def versions_shared() -> bool:
+    """Whether data versions are shared by all workers"""
+    return redis_client is not None
+
+def _version_key(user_id: int) -> str:
+    return f"ver:{user_id}"
+
+async def get_user_data_version(user_id: int) -> int:
+    """Current data version for a user"""
+    if redis_client is not None:
+        try:
+            return int(await redis_client.get(_version_key(user_id)) or 0)
+        except RedisError as e:
+            logger.warning("Redis unavailable, using local data version: %s", e)
+    return _user_data_versions[user_id]
+
+async def bump_user_data_version(*user_ids: int) -> None:
+    """Invalidate cached answers derived from the users' data"""
+    with _versions_lock:
+        for user_id in user_ids:
+            _user_data_versions[user_id] += 1
+    if redis_client is not None and user_ids:
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.incr(_version_key(user_id))
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Redis unavailable, data version bumped locally only: %s", e)
+
+def cached_telemetry(name: str):
+    """Read-through cache for async TelemetryService queries taking (db, user_id, ...)
+
+    Results are keyed by the user's data version, so new telemetry or device
+    changes make older entries unreachable rather than requiring a scan to
+    delete them. Results must be orjson-serializable; they come back from
+    Redis as plain JSON types.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(db, user_id: int, *args, **kwargs):
+            version = await get_user_data_version(user_id)
+            key = f"tele:{name}:{user_id}:{version}:{args!r}:{sorted(kwargs.items())!r}"
+
+            if redis_client is not None:
+                try:
+                    payload = await redis_client.get(key)
+                    if payload is not None:
+                        return orjson.loads(payload)
+                except RedisError as e:
+                    logger.warning("Redis read failed for %s: %s", key, e)
+            else:
+                result = _telemetry_cache.get(key)
+                if result is not None:
+                    return result
+
+            result = await func(db, user_id, *args, **kwargs)
+
+            if redis_client is not None:
+                try:
+                    await redis_client.setex(key, TELEMETRY_CACHE_TTL, orjson.dumps(result))
+                except RedisError as e:
+                    logger.warning("Redis write failed for %s: %s", key, e)
+            else:
+                _telemetry_cache[key] = result
+            return result
+        return wrapper
+    return decorator
@@ -1,12 +1,36 @@
 from passlib.context import CryptContext
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
+import os
+from dotenv import load_dotenv
+load_dotenv()
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is CPU-bound; run it in worker processes so it competes neither
+# with the event loop nor with the threadpool, and bypasses the GIL.
+# Workers come from a forkserver rather than a fork of this process: the
+# API worker already runs threads (log listener, threadpool), and a lock
+# one of them holds at fork time would stay locked in the child.
+HASH_POOL = ProcessPoolExecutor(
+    max_workers=int(os.getenv("BCRYPT_WORKERS", os.cpu_count() or 1)),
+    mp_context=multiprocessing.get_context("forkserver")
+)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Hash a password"""
-    return pwd_context.hash(password) 
\ No newline at end of file
+    return pwd_context.hash(password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hashing process pool"""
+    return await asyncio.get_running_loop().run_in_executor(HASH_POOL, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the hashing process pool"""
+    return await asyncio.get_running_loop().run_in_executor(HASH_POOL, get_password_hash, password)
@@ -1,11 +1,21 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
+import jwt
+from jwt import PyJWTError
 from fastapi import HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from cachetools import TTLCache
+from redis.exceptions import RedisError
+import hashlib
+import logging
+import orjson
 import os
-from app.utils.db import get_db
+import threading
+import time
+import uuid
+from app.utils.db import get_async_db_context
+from app.utils.cache import redis_client
 from app.models.user import User
 from dotenv import load_dotenv
 load_dotenv()
@@ -13,8 +23,44 @@ load_dotenv()
 # JWT Configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+# PEM keys for asymmetric algorithms (e.g. EdDSA); HS* algorithms use SECRET_KEY
+PRIVATE_KEY_PEM = os.getenv("JWT_PRIVATE_KEY")
+PUBLIC_KEY_PEM = os.getenv("JWT_PUBLIC_KEY")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "300"))
 
+# Validated tokens are cached with their user, so repeated requests with the
+# same token skip both signature verification and the DB lookup. Entries
+# never outlive the token's own expiry.
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+_token_cache = TTLCache(maxsize=10000, ttl=USER_CACHE_TTL)
+# jti of logged-out tokens, kept until the tokens would have expired anyway.
+# With Redis configured the denylist is also kept there, so a logout in one
+# worker is honoured by all of them.
+_revoked_tokens = TTLCache(maxsize=100000, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+_cache_lock = threading.Lock()
+
+# Users resolved from tokens are also shared across workers through Redis
+# (when configured), so a token seen first by another worker still skips
+# the users query. Nothing changes a user's credentials or active flag yet;
+# code that does must also drop the user's cache entries.
+USER_REDIS_TTL = int(os.getenv("USER_REDIS_TTL_SECONDS", "900"))
+USER_CACHE_FIELDS = ("id", "email", "username", "is_active", "is_superuser", "created_at", "updated_at")
+
+logger = logging.getLogger(__name__)
+
+def _load_keys():
+    """Parse the signing and verification keys once at import"""
+    if ALGORITHM.startswith("HS"):
+        return SECRET_KEY, SECRET_KEY
+    from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+    if not PRIVATE_KEY_PEM:
+        raise RuntimeError(f"JWT_PRIVATE_KEY must be set for {ALGORITHM}")
+    private_key = load_pem_private_key(PRIVATE_KEY_PEM.encode(), password=None)
+    public_key = load_pem_public_key(PUBLIC_KEY_PEM.encode()) if PUBLIC_KEY_PEM else private_key.public_key()
+    return private_key, public_key
+
+SIGNING_KEY, VERIFYING_KEY = _load_keys()
+
 # Security scheme
 security = HTTPBearer()
 
@@ -26,31 +72,117 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.update({
+        "exp": expire,
+        "iat": datetime.utcnow(),
+        "jti": uuid.uuid4().hex
+    })
+    encoded_jwt = jwt.encode(to_encode, SIGNING_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str) -> Optional[dict]:
     """Verify and decode a JWT token"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, VERIFYING_KEY, algorithms=[ALGORITHM])
         return payload
-    except JWTError:
+    except PyJWTError:
+        return None
+
+def _token_key(token: str) -> str:
+    """Cache key for a raw token"""
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+def _revoked_key(jti: str) -> str:
+    return f"revoked:{jti}"
+
+async def revoke_token(token: str) -> None:
+    """Deny further use of a token and drop its cached user"""
+    payload = verify_token(token)
+    if payload is None:
+        return
+    jti = payload.get("jti")
+    with _cache_lock:
+        if jti:
+            _revoked_tokens[jti] = True
+        _token_cache.pop(_token_key(token), None)
+    remaining = int(payload["exp"] - time.time())
+    if redis_client is not None and jti and remaining > 0:
+        try:
+            await redis_client.setex(_revoked_key(jti), remaining, 1)
+        except RedisError as e:
+            logger.warning("Redis revocation failed, token revoked locally only: %s", e)
+
+async def _is_revoked(jti: Optional[str]) -> bool:
+    """Whether a token was logged out, in this worker or (via Redis) any other"""
+    if not jti:
+        return False
+    with _cache_lock:
+        if jti in _revoked_tokens:
+            return True
+    if redis_client is not None:
+        try:
+            return bool(await redis_client.exists(_revoked_key(jti)))
+        except RedisError as e:
+            logger.warning("Redis revocation check failed: %s", e)
+    return False
+
+def _user_key(user_id) -> str:
+    return f"u:{user_id}"
+
+async def _load_cached_user(user_id) -> Optional[User]:
+    """Detached User rebuilt from Redis, or None on a miss"""
+    if redis_client is None:
         return None
+    try:
+        payload = await redis_client.get(_user_key(user_id))
+    except RedisError as e:
+        logger.warning("Redis user lookup failed: %s", e)
+        return None
+    if payload is None:
+        return None
+    data = orjson.loads(payload)
+    for field in ("created_at", "updated_at"):
+        if data.get(field):
+            data[field] = datetime.fromisoformat(data[field])
+    return User(**data)
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+async def _store_cached_user(user: User) -> None:
+    if redis_client is None:
+        return
+    # the password hash is deliberately left out of the shared cache
+    payload = orjson.dumps({field: getattr(user, field) for field in USER_CACHE_FIELDS})
+    try:
+        await redis_client.setex(_user_key(user.id), USER_REDIS_TTL, payload)
+    except RedisError as e:
+        logger.warning("Redis user store failed: %s", e)
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> User:
-    """Get current authenticated user from JWT token"""
+    """Get current authenticated user from JWT token
+
+    A cached token only costs the revocation check; otherwise the
+    signature is verified on the threadpool and the user is loaded with an
+    async session opened only for that lookup.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    token_key = _token_key(credentials.credentials)
+    with _cache_lock:
+        cached = _token_cache.get(token_key)
+    if cached is not None:
+        user, expires_at, jti = cached
+        if expires_at > time.time():
+            if await _is_revoked(jti):
+                raise credentials_exception
+            return user
+    
     try:
-        payload = verify_token(credentials.credentials)
+        payload = await run_in_threadpool(verify_token, credentials.credentials)
         if payload is None:
             raise credentials_exception
         
@@ -58,17 +190,32 @@ def get_current_user(
         if user_id is None:
             raise credentials_exception
             
-    except JWTError:
+    except PyJWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
+    if await _is_revoked(payload.get("jti")):
         raise credentials_exception
     
+    user = await _load_cached_user(user_id)
+    if user is None:
+        # the session closes right away, leaving a detached instance that can be
+        # cached beyond this request
+        async with get_async_db_context() as db:
+            user = await db.get(User, int(user_id))
+        if user is None:
+            raise credentials_exception
+        await _store_cached_user(user)
+    
+    with _cache_lock:
+        _token_cache[token_key] = (user, min(payload["exp"], time.time() + USER_CACHE_TTL), payload.get("jti"))
     return user
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """Get current active user"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user 
\ No newline at end of file
+    return current_user 
+
+async def get_current_user_id(current_user: User = Depends(get_current_active_user)) -> int:
+    """Id of the current active user, for handlers that only need the id"""
+    return current_user.id
@@ -0,0 +1,39 @@
+from fastapi import Request, Response
+from fastapi.responses import ORJSONResponse
+from typing import Any, Optional
+import hashlib
+import orjson
+from app.utils.cache import get_user_data_version, versions_shared
+
+# Naive datetimes are treated as UTC and numpy values are encoded natively
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+
+def dumps(content: Any) -> bytes:
+    """Encode content exactly as APIJSONResponse does"""
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+class APIJSONResponse(ORJSONResponse):
+    """orjson response that treats naive datetimes as UTC and encodes numpy values"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def not_modified(request: Request, response: Response, etag: str, cache_control: str) -> bool:
+    """Set validator headers on the response and report whether the client copy is current"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Authorization"
+    return request.headers.get("if-none-match") == etag
+
+async def data_version_etag(request: Request, user_id: int) -> Optional[str]:
+    """ETag for a read derived only from the user's data version and the URL
+
+    Lets a handler answer 304 before touching the database. Only offered
+    when versions are shared across workers (Redis); a per-process version
+    could miss another worker's bump and confirm a stale copy.
+    """
+    if not versions_shared():
+        return None
+    version = await get_user_data_version(user_id)
+    raw = f"{user_id}:{version}:{request.url.path}?{request.url.query}"
+    return f'"{hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()}"'
@@ -1,3 +1,4 @@
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from app.models.user import User
 from app.utils.hashing import get_password_hash
@@ -7,35 +8,47 @@ logger = logging.getLogger(__name__)
 
 def create_admin_user(db: Session, username: str = "admin", password: str = "admin123", email: str = "admin@smart-home.com") -> User:
     """Create admin user if it doesn't exist"""
-    # Check if admin user already exists
-    existing_admin = db.query(User).filter(
-        (User.username == username) | (User.email == email)
-    ).first()
+    # Two equality lookups, each a unique-index seek, rather than one OR
+    # filter the planner may turn into a bitmap OR or a scan. Checking
+    # first also skips hashing the password on every startup.
+    existing_admin = (
+        db.query(User).filter(User.username == username).first()
+        or db.query(User).filter(User.email == email).first()
+    )
     
     if existing_admin:
         logger.info(f"Admin user already exists: {existing_admin.username}")
         return existing_admin
     
-    # Create admin user
+    # Create admin user; RETURNING replaces the refresh round trip
     hashed_password = get_password_hash(password)
-    admin_user = User(
-        email=email,
-        username=username,
-        hashed_password=hashed_password,
-        is_active=True,
-        is_superuser=True
-    )
-    
     try:
-        db.add(admin_user)
+        admin_user = db.execute(
+            pg_insert(User)
+            .values(
+                email=email,
+                username=username,
+                hashed_password=hashed_password,
+                is_active=True,
+                is_superuser=True
+            )
+            .on_conflict_do_nothing()
+            .returning(User)
+        ).scalars().first()
         db.commit()
-        db.refresh(admin_user)
-        logger.info(f"Admin user created successfully: {username}")
-        return admin_user
     except Exception as e:
         db.rollback()
         logger.error(f"Error creating admin user: {e}")
         raise
+    
+    if admin_user is None:
+        # Created concurrently since the check above
+        return (
+            db.query(User).filter(User.username == username).first()
+            or db.query(User).filter(User.email == email).first()
+        )
+    logger.info(f"Admin user created successfully: {username}")
+    return admin_user
 
 def seed_database(db: Session):
     """Seed the database with initial data"""
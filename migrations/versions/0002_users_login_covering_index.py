@@ -0,0 +1,28 @@
+"""Covering index for the login lookup on users
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-01-15 10:05:00
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_login_covering "
+            "ON users (email) INCLUDE (hashed_password, is_active, id, username)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_users_login_covering")
@@ -0,0 +1,32 @@
+"""Replace idx_device_timestamp with a descending covering index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-01-15 10:10:00
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_device_ts_desc "
+            "ON telemetry (device_id, timestamp DESC) INCLUDE (energy_watts)"
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_device_timestamp")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_device_timestamp "
+            "ON telemetry (device_id, timestamp)"
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_device_ts_desc")
@@ -0,0 +1,32 @@
+"""Make telemetry a TimescaleDB hypertable
+
+The primary key becomes (id, timestamp) because TimescaleDB requires the
+partitioning column in every unique index. The hypertable, compression
+and retention policies are only set up when the timescaledb extension is
+available on the server.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-01-15 10:15:00
+"""
+from alembic import op
+from app.utils.db import enable_telemetry_hypertable
+
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_constraint("telemetry_pkey", "telemetry", type_="primary")
+    op.create_primary_key("telemetry_pkey", "telemetry", ["id", "timestamp"])
+    enable_telemetry_hypertable(op.get_bind())
+
+
+def downgrade():
+    # A hypertable cannot be converted back in place; only the key is restored
+    op.drop_constraint("telemetry_pkey", "telemetry", type_="primary")
+    op.create_primary_key("telemetry_pkey", "telemetry", ["id"])
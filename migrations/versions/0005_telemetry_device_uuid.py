@@ -0,0 +1,28 @@
+"""Denormalize the device UUID onto telemetry
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-01-15 10:20:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("telemetry", sa.Column("device_uuid", sa.String(36), nullable=True))
+    op.execute(
+        "UPDATE telemetry t SET device_uuid = d.device_id "
+        "FROM devices d WHERE d.id = t.device_id"
+    )
+    op.alter_column("telemetry", "device_uuid", nullable=False)
+
+
+def downgrade():
+    op.drop_column("telemetry", "device_uuid")
@@ -0,0 +1,60 @@
+"""Store device UUIDs in native uuid columns
+
+devices.device_id and telemetry.device_uuid move from varchar to the
+16-byte uuid type. TimescaleDB does not allow column type changes while
+compression is enabled, so compression is switched off around the change
+and set up again afterwards.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-01-15 10:25:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.db import enable_telemetry_hypertable
+
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def _telemetry_compressed(bind) -> bool:
+    if bind.dialect.name != "postgresql":
+        return False
+    if not bind.exec_driver_sql("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'").scalar():
+        return False
+    return bool(bind.exec_driver_sql(
+        "SELECT compression_enabled FROM timescaledb_information.hypertables "
+        "WHERE hypertable_name = 'telemetry'"
+    ).scalar())
+
+
+def _disable_compression():
+    op.execute("SELECT remove_compression_policy('telemetry', if_exists => TRUE)")
+    op.execute("SELECT decompress_chunk(c, if_compressed => TRUE) FROM show_chunks('telemetry') c")
+    op.execute("ALTER TABLE telemetry SET (timescaledb.compress = false)")
+
+
+def upgrade():
+    bind = op.get_bind()
+    compressed = _telemetry_compressed(bind)
+    if compressed:
+        _disable_compression()
+    op.alter_column("devices", "device_id", type_=sa.Uuid(), postgresql_using="device_id::uuid")
+    op.alter_column("telemetry", "device_uuid", type_=sa.Uuid(), postgresql_using="device_uuid::uuid")
+    if compressed:
+        enable_telemetry_hypertable(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    compressed = _telemetry_compressed(bind)
+    if compressed:
+        _disable_compression()
+    op.alter_column("telemetry", "device_uuid", type_=sa.String(36), postgresql_using="device_uuid::text")
+    op.alter_column("devices", "device_id", type_=sa.String(), postgresql_using="device_id::text")
+    if compressed:
+        enable_telemetry_hypertable(bind)
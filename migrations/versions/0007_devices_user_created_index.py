@@ -0,0 +1,27 @@
+"""Index devices by owner and creation order for keyset pagination
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-01-15 10:30:00
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_devices_user_created "
+            "ON devices (user_id, created_at DESC, id DESC)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_devices_user_created")
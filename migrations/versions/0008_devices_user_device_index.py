@@ -0,0 +1,27 @@
+"""Index devices by owner and device UUID
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-01-16 09:00:00
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_devices_user_device "
+            "ON devices (user_id, device_id)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_devices_user_device")
@@ -0,0 +1,32 @@
+"""Replace the B-tree timestamp index on telemetry with BRIN
+
+Telemetry is append-only with monotonically increasing timestamps, so a
+BRIN index answers time-range filters at a fraction of the B-tree's size
+and insert cost. Lookups by device keep using idx_device_ts_desc. Built
+without CONCURRENTLY since hypertables do not support it.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-01-16 09:10:00
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_telemetry_timestamp_brin "
+        "ON telemetry USING brin (timestamp)"
+    )
+    op.execute("DROP INDEX IF EXISTS ix_telemetry_timestamp")
+
+
+def downgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS ix_telemetry_timestamp ON telemetry (timestamp)")
+    op.execute("DROP INDEX IF EXISTS ix_telemetry_timestamp_brin")
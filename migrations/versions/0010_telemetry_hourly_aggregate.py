@@ -0,0 +1,30 @@
+"""Hourly per-device telemetry rollup as a TimescaleDB continuous aggregate
+
+Summary and ranking queries read these hourly rows instead of every raw
+reading. Only created when telemetry is a hypertable; the service falls
+back to the raw table otherwise.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2025-01-16 09:20:00
+"""
+from alembic import op
+from app.utils.db import enable_telemetry_hourly_aggregate
+
+
+# revision identifiers, used by Alembic.
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # continuous aggregates cannot be created inside a transaction
+    with op.get_context().autocommit_block():
+        enable_telemetry_hourly_aggregate(op.get_bind())
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP MATERIALIZED VIEW IF EXISTS telemetry_hourly")
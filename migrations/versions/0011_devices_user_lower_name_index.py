@@ -0,0 +1,27 @@
+"""Index devices by owner and case-folded name
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2025-01-16 09:30:00
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_devices_user_lower_name "
+            "ON devices (user_id, lower(name))"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_devices_user_lower_name")
@@ -0,0 +1,33 @@
+"""Cover every column the login path reads in the users login index
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2025-01-16 10:00:00
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def _recreate(include):
+    # INCLUDE columns cannot be altered, so the index is rebuilt; lookups by
+    # email fall back to the unique email index in between
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_users_login_covering")
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_login_covering "
+            f"ON users (email) INCLUDE ({include})"
+        )
+
+
+def upgrade():
+    _recreate("hashed_password, is_active, id, username, is_superuser, created_at")
+
+
+def downgrade():
+    _recreate("hashed_password, is_active, id, username")
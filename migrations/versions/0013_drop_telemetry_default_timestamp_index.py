@@ -0,0 +1,28 @@
+"""Drop TimescaleDB's default B-tree timestamp index on telemetry
+
+create_hypertable built telemetry_timestamp_idx on (timestamp DESC) in
+migration 0004, so inserts still maintained a timestamp B-tree next to
+the BRIN index from 0009. New databases skip it (create_default_indexes
+=> FALSE); this drops it from existing ones. Built without CONCURRENTLY
+since hypertables do not support it.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2025-01-16 10:10:00
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("DROP INDEX IF EXISTS telemetry_timestamp_idx")
+
+
+def downgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS telemetry_timestamp_idx ON telemetry (timestamp DESC)")
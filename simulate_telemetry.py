@@ -4,33 +4,35 @@ Telemetry Simulation Script
 Generates sample telemetry data for testing the API
 """
 
-import requests
-import random
-import time
-import uuid
+import asyncio
+import httpx
+import numpy as np
 from datetime import datetime, timedelta
-import json
 
 # Configuration
 BASE_URL = "http://localhost:8000"
 ADMIN_EMAIL = "admin@smart-home.com"
 ADMIN_PASSWORD = "admin123"
+# Readings per /ingest-batch request (the API accepts up to 5000)
+BATCH_SIZE = 5000
+# Upper bound on concurrent connections to the API
+MAX_CONNECTIONS = 64
 
-def login_admin():
+async def login_admin(client):
     """Login as admin and get access token"""
     login_data = {
         "email": ADMIN_EMAIL,
         "password": ADMIN_PASSWORD
     }
     
-    response = requests.post(f"{BASE_URL}/api/auth/login", json=login_data)
+    response = await client.post("/api/auth/login", json=login_data)
     if response.status_code == 200:
         return response.json()["access_token"]
     else:
         print(f"Login failed: {response.text}")
         return None
 
-def create_test_devices(token):
+async def create_test_devices(client, token):
     """Create test devices for the admin user"""
     headers = {"Authorization": f"Bearer {token}"}
     
@@ -44,7 +46,7 @@ def create_test_devices(token):
     
     created_devices = []
     for device_data in devices:
-        response = requests.post(f"{BASE_URL}/api/devices/", json=device_data, headers=headers)
+        response = await client.post("/api/devices/", json=device_data, headers=headers)
         if response.status_code == 201:
             device = response.json()
             created_devices.append(device)
@@ -54,8 +56,8 @@ def create_test_devices(token):
     
     return created_devices
 
-def generate_telemetry_data(device_id, hours=24):
-    """Generate telemetry data for a device"""
+def generate_telemetry_data(device, hours=24):
+    """Generate telemetry data for a device (as returned by the create call)"""
     start_time = datetime.utcnow() - timedelta(hours=hours)
     
     # Different power ranges for different device types
@@ -66,84 +68,88 @@ def generate_telemetry_data(device_id, hours=24):
         "appliance": (200, 800)
     }
     
-    # Get device type to determine power range
-    response = requests.get(f"{BASE_URL}/api/devices/{device_id}")
-    if response.status_code == 200:
-        device_type = response.json()["device_type"]
-        min_power, max_power = power_ranges.get(device_type, (50, 300))
-    else:
-        min_power, max_power = 50, 300
+    # The device type determines the power range
+    min_power, max_power = power_ranges.get(device["device_type"], (50, 300))
     
-    telemetry_data = []
+    # One reading per minute, all generated as arrays at once
+    n = hours * 60
+    minutes = np.arange(n)
+    timestamps = [start_time + timedelta(minutes=int(i)) for i in minutes]
     
-    for i in range(hours * 60):  # One reading per minute
-        timestamp = start_time + timedelta(minutes=i)
-        
-        # Add some realistic variation
-        base_power = random.uniform(min_power, max_power)
-        # Add some noise and time-based patterns
-        noise = random.uniform(-0.1, 0.1) * base_power
-        time_factor = 1.0 + 0.2 * abs((timestamp.hour - 12) / 12)  # Higher usage during day
-        
-        energy_watts = max(0, base_power + noise) * time_factor
-        
-        telemetry_data.append({
-            "device_id": device_id,
-            "timestamp": timestamp.isoformat() + "Z",
-            "energy_watts": round(energy_watts, 2)
-        })
+    # Add some realistic variation
+    base_power = np.random.uniform(min_power, max_power, n)
+    # Add some noise and time-based patterns
+    noise = np.random.uniform(-0.1, 0.1, n) * base_power
+    hour_of_day = (start_time.hour + (start_time.minute + minutes) // 60) % 24
+    time_factor = 1.0 + 0.2 * np.abs((hour_of_day - 12) / 12)  # Higher usage during day
+    
+    energy_watts = np.round(np.maximum(0, base_power + noise) * time_factor, 2)
     
-    return telemetry_data
+    return [
+        {
+            "device_id": device["device_id"],
+            "timestamp": timestamp.isoformat() + "Z",
+            "energy_watts": watts
+        }
+        for timestamp, watts in zip(timestamps, energy_watts.tolist())
+    ]
 
-def send_telemetry_data(telemetry_data, token):
-    """Send telemetry data to the API"""
+async def send_telemetry_data(client, telemetry_data, token):
+    """Send telemetry data to the API in batches, all batches in parallel"""
     headers = {"Authorization": f"Bearer {token}"}
     
+    batches = [telemetry_data[i:i + BATCH_SIZE] for i in range(0, len(telemetry_data), BATCH_SIZE)]
+    responses = await asyncio.gather(*[
+        client.post("/api/telemetry/ingest-batch", json=batch, headers=headers)
+        for batch in batches
+    ])
+    
     success_count = 0
-    for data in telemetry_data:
-        response = requests.post(f"{BASE_URL}/api/telemetry/ingest", json=data, headers=headers)
+    for response in responses:
         if response.status_code == 201:
-            success_count += 1
+            success_count += response.json()["ingested"]
         else:
-            print(f"Failed to send telemetry: {response.text}")
+            print(f"Failed to send telemetry batch: {response.text}")
     
     return success_count
 
-def main():
+async def send_device_telemetry(client, device, token):
+    """Generate and send a day of telemetry for one device"""
+    telemetry_data = generate_telemetry_data(device, hours=24)
+    sent_count = await send_telemetry_data(client, telemetry_data, token)
+    print(f"✅ Sent {sent_count} of {len(telemetry_data)} records for {device['name']}")
+    return sent_count
+
+async def main():
     print("Starting telemetry simulation...")
     
-    # Login as admin
-    token = login_admin()
-    if not token:
-        print("Failed to login. Exiting.")
-        return
-    
-    print("✅ Logged in successfully")
-    
-    # Create test devices
-    print("\nCreating test devices...")
-    devices = create_test_devices(token)
-    
-    if not devices:
-        print("No devices created. Exiting.")
-        return
-    
-    print(f"✅ Created {len(devices)} devices")
-    
-    # Generate and send telemetry data
-    print("\nGenerating telemetry data...")
-    total_sent = 0
-    
-    for device in devices:
-        print(f"Generating data for {device['name']}...")
-        telemetry_data = generate_telemetry_data(device['device_id'], hours=24)
+    # One client for the whole run: connections are kept alive and reused
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS)
+    async with httpx.AsyncClient(base_url=BASE_URL, limits=limits, timeout=60.0) as client:
+        # Login as admin
+        token = await login_admin(client)
+        if not token:
+            print("Failed to login. Exiting.")
+            return
+        
+        print("✅ Logged in successfully")
+        
+        # Create test devices
+        print("\nCreating test devices...")
+        devices = await create_test_devices(client, token)
+        
+        if not devices:
+            print("No devices created. Exiting.")
+            return
         
-        print(f"Sending {len(telemetry_data)} telemetry records...")
-        sent_count = send_telemetry_data(telemetry_data, token)
-        total_sent += sent_count
+        print(f"✅ Created {len(devices)} devices")
         
-        print(f"✅ Sent {sent_count} records for {device['name']}")
-        time.sleep(0.1)  # Small delay between devices
+        # Generate and send telemetry data, all devices concurrently
+        print("\nGenerating and sending telemetry data...")
+        sent_counts = await asyncio.gather(*[
+            send_device_telemetry(client, device, token) for device in devices
+        ])
+        total_sent = sum(sent_counts)
     
     print(f"\n🎉 Simulation complete!")
     print(f"Total telemetry records sent: {total_sent}")
@@ -158,4 +164,4 @@ def main():
     print(f"GET {BASE_URL}/api/devices/")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    asyncio.run(main()) 
\ No newline at end of file
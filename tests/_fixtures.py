@@ -0,0 +1,104 @@
+"""
+Shared setup for the API test scripts
+Server address, admin credentials, client settings and a cached login
+"""
+import base64
+import httpx
+import orjson
+import os
+import time
+
+# Configuration
+BASE_URL = "http://localhost:8000"
+ADMIN_EMAIL = "admin@smart-home.com"
+ADMIN_PASSWORD = "admin123"
+
+# Each script shares one HTTP/2 client across its tests, so independent
+# requests overlap on pooled connections
+CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=20)
+# Bodies are encoded with orjson and sent as content, so declare the type
+CLIENT_HEADERS = {"Accept": "application/json", "Content-Type": "application/json"}
+
+# Login tokens are cached here between runs (and across scripts) so repeat
+# runs skip the login call
+TOKEN_CACHE_PATH = os.path.expanduser("~/.cache/smarthome_test_token.json")
+
+# Failed connection attempts are retried; responses (including 5xx) are
+# not, since the ingest calls are not idempotent
+CONNECT_RETRIES = 2
+
+def make_client(**kwargs):
+    """Async client for the API with the shared settings"""
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=CLIENT_LIMITS, retries=CONNECT_RETRIES)
+    return httpx.AsyncClient(
+        base_url=BASE_URL,
+        transport=transport,
+        headers=CLIENT_HEADERS,
+        **kwargs
+    )
+
+def load_cached_token():
+    """Return the cached login for this server and user if it is still valid for a minute"""
+    try:
+        with open(TOKEN_CACHE_PATH, "rb") as f:
+            cached = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    if cached.get("base_url") != BASE_URL or cached.get("email") != ADMIN_EMAIL:
+        return None
+    if cached.get("exp", 0) - time.time() <= 60:
+        return None
+    return cached
+
+def save_cached_token(token):
+    """Cache a login token on disk until it expires and return its user id"""
+    payload = orjson.loads(base64.urlsafe_b64decode(token.split(".")[1] + "=="))
+    cached = {
+        "base_url": BASE_URL,
+        "email": ADMIN_EMAIL,
+        "access_token": token,
+        "user_id": int(payload["sub"]),
+        "exp": payload["exp"]
+    }
+    os.makedirs(os.path.dirname(TOKEN_CACHE_PATH), exist_ok=True)
+    tmp_path = f"{TOKEN_CACHE_PATH}.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(cached))
+    os.replace(tmp_path, TOKEN_CACHE_PATH)
+    return cached["user_id"]
+
+def forget_cached_token():
+    """Delete the cached login so the next login() asks the server again"""
+    try:
+        os.remove(TOKEN_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+
+async def login(client):
+    """Login as admin, reusing a cached token; returns (access_token, user_id) or None
+
+    A cached token is checked against /api/auth/me first. The server may
+    have been reset, or the token revoked by a logout, since it was saved.
+    On a 401 the cache is dropped and a fresh login is made.
+    """
+    cached = load_cached_token()
+    if cached:
+        response = await client.get(
+            "/api/auth/me",
+            headers={"Authorization": f"Bearer {cached['access_token']}"}
+        )
+        if response.status_code != 401:
+            return cached["access_token"], cached["user_id"]
+        forget_cached_token()
+
+    login_data = {
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD
+    }
+
+    response = await client.post("/api/auth/login", content=orjson.dumps(login_data))
+    if response.status_code != 200:
+        print(f"Login failed: {response.status_code} {response.text}")
+        return None
+    token = orjson.loads(response.content)["access_token"]
+    return token, save_cached_token(token)
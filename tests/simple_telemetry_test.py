@@ -3,20 +3,18 @@
 Simple Telemetry Test for Smart Home Energy Monitoring API
 Tests all telemetry endpoints and prints clear results
 """
-import requests
-import time
+import asyncio
+import orjson
 import uuid
 from datetime import datetime, timedelta
-
-# Configuration
-BASE_URL = "http://localhost:8000"
-TEST_EMAIL = "admin@smart-home.com"
-TEST_PASSWORD = "admin123"
+from functools import wraps
+from _fixtures import BASE_URL, ADMIN_EMAIL as TEST_EMAIL, login, make_client
 
 # Global variables to store test data
 access_token = None
 user_id = None
 device_id = None
+auth_headers = None  # built once at login
 
 def print_result(test_name, success, message=""):
     """Print test result with clear formatting"""
@@ -26,64 +24,72 @@ def print_result(test_name, success, message=""):
         print(f"❌ {test_name}: FAILED - {message}")
     print()
 
-def test_health_check():
+def testcase(name, error_message=None):
+    """Report an exception raised by the test coroutine as a failure of `name`"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                print_result(name, False, error_message or str(e))
+                return False
+        return wrapper
+    return decorator
+
+async def fetch_status(client, method, url, **kwargs):
+    """Status code of a request whose body the test does not need
+
+    The response is streamed and closed without reading the body.
+    """
+    async with client.stream(method, url, **kwargs) as response:
+        return response.status_code
+
+@testcase("Health Check", "Cannot connect to server")
+async def test_health_check(client):
     """Test if server is running"""
     print("🏥 Testing server health...")
-    try:
-        response = requests.get(f"{BASE_URL}/health")
-        success = response.status_code == 200
-        print_result("Health Check", success, f"Status: {response.status_code}")
-        return success
-    except:
-        print_result("Health Check", False, "Cannot connect to server")
-        return False
+    status_code = await fetch_status(client, "GET", "/health")
+    success = status_code == 200
+    print_result("Health Check", success, f"Status: {status_code}")
+    return success
 
-def test_telemetry_health():
+@testcase("Telemetry Health")
+async def test_telemetry_health(client):
     """Test telemetry service health"""
     print("📊 Testing telemetry health...")
-    try:
-        response = requests.get(f"{BASE_URL}/api/telemetry/health")
-        success = response.status_code == 200
-        print_result("Telemetry Health", success, f"Status: {response.status_code}")
-        return success
-    except Exception as e:
-        print_result("Telemetry Health", False, str(e))
-        return False
+    status_code = await fetch_status(client, "GET", "/api/telemetry/health")
+    success = status_code == 200
+    print_result("Telemetry Health", success, f"Status: {status_code}")
+    return success
 
-def test_register_user():
+async def test_register_user(client):
     """Test user registration (skipped - using existing user)"""
     print("📝 Testing user registration (skipped)...")
     print_result("User Registration", True, "Using existing user")
     return True
 
-def test_login_user():
+@testcase("User Login")
+async def test_login_user(client):
     """Test user login and get access token"""
-    global access_token, user_id
+    global access_token, user_id, auth_headers
     print("🔐 Testing user login...")
-    data = {
-        "email": TEST_EMAIL,
-        "password": TEST_PASSWORD
-    }
     
-    try:
-        response = requests.post(f"{BASE_URL}/api/auth/login", json=data)
-        success = response.status_code == 200
-        if success:
-            result = response.json()
-            access_token = result.get('access_token')
-            user_id = result.get('user', {}).get('id')
-            print(f"✅ User Login: PASSED")
-            print(f"   Token: {access_token[:20] if access_token else 'N/A'}...")
-            print(f"   User ID: {user_id}")
-        else:
-            print(f"❌ User Login: FAILED - Status: {response.status_code}")
-        print()
-        return success
-    except Exception as e:
-        print_result("User Login", False, str(e))
-        return False
+    credentials = await login(client)
+    success = credentials is not None
+    if success:
+        access_token, user_id = credentials
+        auth_headers = {"Authorization": f"Bearer {access_token}"}
+        print(f"✅ User Login: PASSED")
+        print(f"   Token: {access_token[:20]}...")
+        print(f"   User ID: {user_id}")
+    else:
+        print(f"❌ User Login: FAILED")
+    print()
+    return success
 
-def test_create_device():
+@testcase("Device Creation")
+async def test_create_device(client):
     """Test device creation"""
     global device_id
     print("🔌 Testing device creation...")
@@ -92,30 +98,26 @@ def test_create_device():
         print_result("Device Creation", False, "No access token available")
         return False
     
-    headers = {"Authorization": f"Bearer {access_token}"}
+    # Same device every run: later runs get 409 and reuse it
     data = {
-        "device_id": str(uuid.uuid4()),
+        "device_id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{BASE_URL}/perftest/{TEST_EMAIL}/fridge")),
         "name": "Test Fridge",
         "device_type": "fridge"
     }
     
-    try:
-        response = requests.post(f"{BASE_URL}/api/devices/", json=data, headers=headers)
-        success = response.status_code == 201
-        if success:
-            result = response.json()
-            device_id = result.get('device_id')
-            print(f"✅ Device Creation: PASSED")
-            print(f"   Device ID: {device_id}")
-        else:
-            print(f"❌ Device Creation: FAILED - Status: {response.status_code}")
-        print()
-        return success
-    except Exception as e:
-        print_result("Device Creation", False, str(e))
-        return False
+    status_code = await fetch_status(client, "POST", "/api/devices/", content=orjson.dumps(data), headers=auth_headers)
+    success = status_code in (201, 409)
+    if success:
+        device_id = data["device_id"]
+        print(f"✅ Device Creation: PASSED{' (already exists)' if status_code == 409 else ''}")
+        print(f"   Device ID: {device_id}")
+    else:
+        print(f"❌ Device Creation: FAILED - Status: {status_code}")
+    print()
+    return success
 
-def test_ingest_telemetry():
+@testcase("Telemetry Ingestion")
+async def test_ingest_telemetry(client):
     """Test telemetry ingestion"""
     print("📈 Testing telemetry ingestion...")
     
@@ -129,23 +131,20 @@ def test_ingest_telemetry():
         "energy_watts": 150.5
     }
     
-    try:
-        response = requests.post(f"{BASE_URL}/api/telemetry/ingest", json=data)
-        success = response.status_code == 201
-        if success:
-            result = response.json()
-            print(f"✅ Telemetry Ingestion: PASSED")
-            print(f"   Energy: {result.get('energy_watts')} watts")
-            print(f"   Timestamp: {result.get('timestamp')}")
-        else:
-            print(f"❌ Telemetry Ingestion: FAILED - Status: {response.status_code}")
-        print()
-        return success
-    except Exception as e:
-        print_result("Telemetry Ingestion", False, str(e))
-        return False
+    response = await client.post("/api/telemetry/ingest", content=orjson.dumps(data))
+    success = response.status_code == 201
+    if success:
+        result = orjson.loads(response.content)
+        print(f"✅ Telemetry Ingestion: PASSED")
+        print(f"   Energy: {result.get('energy_watts')} watts")
+        print(f"   Timestamp: {result.get('timestamp')}")
+    else:
+        print(f"❌ Telemetry Ingestion: FAILED - Status: {response.status_code}")
+    print()
+    return success
 
-def test_ingest_multiple_telemetry():
+@testcase("Multiple Telemetry")
+async def test_ingest_multiple_telemetry(client):
     """Test multiple telemetry ingestion"""
     print("📊 Testing multiple telemetry ingestion...")
     
@@ -154,32 +153,41 @@ def test_ingest_multiple_telemetry():
         return False
     
     # Create multiple telemetry records with different timestamps
-    timestamps = [
-        (datetime.now() - timedelta(hours=2)).isoformat(),
-        (datetime.now() - timedelta(hours=1)).isoformat(),
-        datetime.now().isoformat()
-    ]
+    now = datetime.now()
+    timestamps = [(now - timedelta(hours=hours)).isoformat() for hours in (2, 1, 0)]
     
-    success_count = 0
-    for i, timestamp in enumerate(timestamps):
-        data = {
+    readings = [
+        {
             "device_id": device_id,
             "timestamp": timestamp,
             "energy_watts": 100.0 + (i * 25.0)  # Different energy values
         }
-        
-        try:
-            response = requests.post(f"{BASE_URL}/api/telemetry/ingest", json=data)
-            if response.status_code == 201:
-                success_count += 1
-        except:
-            pass
+        for i, timestamp in enumerate(timestamps)
+    ]
+    
+    # One request and one transaction for the whole batch
+    response = await client.post("/api/telemetry/ingest-batch", content=orjson.dumps(readings))
+    
+    if response.status_code == 201:
+        success_count = orjson.loads(response.content).get("ingested", 0)
+    elif response.status_code in (404, 405):
+        # Older servers without the batch endpoint: post the readings concurrently
+        responses = await asyncio.gather(*[
+            client.post("/api/telemetry/ingest", content=orjson.dumps(reading)) for reading in readings
+        ], return_exceptions=True)
+        success_count = sum(
+            1 for response in responses
+            if not isinstance(response, Exception) and response.status_code == 201
+        )
+    else:
+        success_count = 0
     
     success = success_count == len(timestamps)
     print_result("Multiple Telemetry", success, f"Created {success_count}/{len(timestamps)} records")
     return success
 
-def test_get_device_telemetry():
+@testcase("Get Device Telemetry")
+async def test_get_device_telemetry(client):
     """Test getting device telemetry"""
     print("📋 Testing get device telemetry...")
     
@@ -187,24 +195,19 @@ def test_get_device_telemetry():
         print_result("Get Device Telemetry", False, "No access token or device ID available")
         return False
     
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    try:
-        response = requests.get(f"{BASE_URL}/api/telemetry/device/{device_id}", headers=headers)
-        success = response.status_code == 200
-        if success:
-            result = response.json()
-            print(f"✅ Get Device Telemetry: PASSED")
-            print(f"   Records: {len(result)}")
-        else:
-            print(f"❌ Get Device Telemetry: FAILED - Status: {response.status_code}")
-        print()
-        return success
-    except Exception as e:
-        print_result("Get Device Telemetry", False, str(e))
-        return False
+    response = await client.get(f"/api/telemetry/device/{device_id}", headers=auth_headers)
+    success = response.status_code == 200
+    if success:
+        result = orjson.loads(response.content)
+        print(f"✅ Get Device Telemetry: PASSED")
+        print(f"   Records: {len(result)}")
+    else:
+        print(f"❌ Get Device Telemetry: FAILED - Status: {response.status_code}")
+    print()
+    return success
 
-def test_get_my_devices_telemetry():
+@testcase("Get My Devices Telemetry")
+async def test_get_my_devices_telemetry(client):
     """Test getting all user devices telemetry"""
     print("🏠 Testing get my devices telemetry...")
     
@@ -212,24 +215,20 @@ def test_get_my_devices_telemetry():
         print_result("Get My Devices Telemetry", False, "No access token available")
         return False
     
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    try:
-        response = requests.get(f"{BASE_URL}/api/telemetry/my-devices", headers=headers)
-        success = response.status_code == 200
-        if success:
-            result = response.json()
-            print(f"✅ Get My Devices Telemetry: PASSED")
-            print(f"   Devices: {len(result)}")
-        else:
-            print(f"❌ Get My Devices Telemetry: FAILED - Status: {response.status_code}")
-        print()
-        return success
-    except Exception as e:
-        print_result("Get My Devices Telemetry", False, str(e))
-        return False
+    response = await client.get("/api/telemetry/my-devices", headers=auth_headers)
+    success = response.status_code == 200
+    if success:
+        result = orjson.loads(response.content)
+        print(f"✅ Get My Devices Telemetry: PASSED")
+        print(f"   Devices: {len(result)}")
+        print(f"   Readings: {sum(device['telemetry_count'] for device in result)}")
+    else:
+        print(f"❌ Get My Devices Telemetry: FAILED - Status: {response.status_code}")
+    print()
+    return success
 
-def test_get_energy_summary():
+@testcase("Energy Summary")
+async def test_get_energy_summary(client):
     """Test getting energy summary"""
     print("📊 Testing energy summary...")
     
@@ -237,24 +236,18 @@ def test_get_energy_summary():
         print_result("Energy Summary", False, "No access token available")
         return False
     
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    try:
-        response = requests.get(f"{BASE_URL}/api/telemetry/summary", headers=headers)
-        success = response.status_code == 200
-        if success:
-            result = response.json()
-            print(f"✅ Energy Summary: PASSED")
-            print(f"   Summary data received")
-        else:
-            print(f"❌ Energy Summary: FAILED - Status: {response.status_code}")
-        print()
-        return success
-    except Exception as e:
-        print_result("Energy Summary", False, str(e))
-        return False
+    status_code = await fetch_status(client, "GET", "/api/telemetry/summary", headers=auth_headers)
+    success = status_code == 200
+    if success:
+        print(f"✅ Energy Summary: PASSED")
+        print(f"   Summary data received")
+    else:
+        print(f"❌ Energy Summary: FAILED - Status: {status_code}")
+    print()
+    return success
 
-def test_get_top_consuming_devices():
+@testcase("Top Consuming Devices")
+async def test_get_top_consuming_devices(client):
     """Test getting top consuming devices"""
     print("🔥 Testing top consuming devices...")
     
@@ -262,38 +255,29 @@ def test_get_top_consuming_devices():
         print_result("Top Consuming Devices", False, "No access token available")
         return False
     
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    try:
-        response = requests.get(f"{BASE_URL}/api/telemetry/top-consuming", headers=headers)
-        success = response.status_code == 200
-        if success:
-            result = response.json()
-            print(f"✅ Top Consuming Devices: PASSED")
-            print(f"   Top devices data received")
-        else:
-            print(f"❌ Top Consuming Devices: FAILED - Status: {response.status_code}")
-        print()
-        return success
-    except Exception as e:
-        print_result("Top Consuming Devices", False, str(e))
-        return False
+    status_code = await fetch_status(client, "GET", "/api/telemetry/top-consuming", headers=auth_headers)
+    success = status_code == 200
+    if success:
+        print(f"✅ Top Consuming Devices: PASSED")
+        print(f"   Top devices data received")
+    else:
+        print(f"❌ Top Consuming Devices: FAILED - Status: {status_code}")
+    print()
+    return success
 
-def test_unauthorized_access():
+@testcase("Unauthorized Access")
+async def test_unauthorized_access(client):
     """Test unauthorized access to telemetry endpoints"""
     print("🚫 Testing unauthorized access...")
     
     # Try to access telemetry without token
-    try:
-        response = requests.get(f"{BASE_URL}/api/telemetry/my-devices")
-        success = response.status_code in [401, 403]  # Accept both 401 and 403
-        print_result("Unauthorized Access", success, f"Status: {response.status_code}")
-        return success
-    except Exception as e:
-        print_result("Unauthorized Access", False, str(e))
-        return False
+    status_code = await fetch_status(client, "GET", "/api/telemetry/my-devices")
+    success = status_code in [401, 403]  # Accept both 401 and 403
+    print_result("Unauthorized Access", success, f"Status: {status_code}")
+    return success
 
-def test_invalid_telemetry_data():
+@testcase("Invalid Telemetry Data")
+async def test_invalid_telemetry_data(client):
     """Test invalid telemetry data"""
     print("⚠️ Testing invalid telemetry data...")
     
@@ -307,16 +291,12 @@ def test_invalid_telemetry_data():
         # Missing timestamp and energy_watts
     }
     
-    try:
-        response = requests.post(f"{BASE_URL}/api/telemetry/ingest", json=data)
-        success = response.status_code == 422
-        print_result("Invalid Telemetry Data", success, f"Status: {response.status_code}")
-        return success
-    except Exception as e:
-        print_result("Invalid Telemetry Data", False, str(e))
-        return False
+    status_code = await fetch_status(client, "POST", "/api/telemetry/ingest", content=orjson.dumps(data))
+    success = status_code == 422
+    print_result("Invalid Telemetry Data", success, f"Status: {status_code}")
+    return success
 
-def main():
+async def main():
     """Run all tests"""
     print("🚀 SMART HOME ENERGY MONITORING - TELEMETRY TEST")
     print("=" * 60)
@@ -328,20 +308,28 @@ def main():
     # Track results
     results = []
     
-    # Run tests in order (some depend on previous tests)
-    results.append(("Health Check", test_health_check()))
-    results.append(("Telemetry Health", test_telemetry_health()))
-    results.append(("User Registration", test_register_user()))
-    results.append(("User Login", test_login_user()))
-    results.append(("Device Creation", test_create_device()))
-    results.append(("Telemetry Ingestion", test_ingest_telemetry()))
-    results.append(("Multiple Telemetry", test_ingest_multiple_telemetry()))
-    results.append(("Get Device Telemetry", test_get_device_telemetry()))
-    results.append(("Get My Devices Telemetry", test_get_my_devices_telemetry()))
-    results.append(("Energy Summary", test_get_energy_summary()))
-    results.append(("Top Consuming Devices", test_get_top_consuming_devices()))
-    results.append(("Unauthorized Access", test_unauthorized_access()))
-    results.append(("Invalid Telemetry Data", test_invalid_telemetry_data()))
+    async with make_client() as client:
+        # Run the setup tests in order (later tests depend on them)
+        results.append(("Health Check", await test_health_check(client)))
+        results.append(("User Registration", await test_register_user(client)))
+        results.append(("User Login", await test_login_user(client)))
+        results.append(("Device Creation", await test_create_device(client)))
+        results.append(("Telemetry Ingestion", await test_ingest_telemetry(client)))
+        results.append(("Multiple Telemetry", await test_ingest_multiple_telemetry(client)))
+        
+        # The read-only checks are independent of each other, so run them concurrently
+        read_tests = [
+            ("Telemetry Health", test_telemetry_health),
+            ("Get Device Telemetry", test_get_device_telemetry),
+            ("Get My Devices Telemetry", test_get_my_devices_telemetry),
+            ("Energy Summary", test_get_energy_summary),
+            ("Top Consuming Devices", test_get_top_consuming_devices),
+            ("Unauthorized Access", test_unauthorized_access),
+        ]
+        read_results = await asyncio.gather(*[test(client) for _, test in read_tests])
+        results.extend(zip([name for name, _ in read_tests], read_results))
+        
+        results.append(("Invalid Telemetry Data", await test_invalid_telemetry_data(client)))
     
     # Summary
     print("=" * 60)
@@ -366,4 +354,4 @@ def main():
     print("=" * 60)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    asyncio.run(main()) 
\ No newline at end of file
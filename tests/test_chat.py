@@ -4,98 +4,106 @@ Test script for the Conversational AI service
 Demonstrates natural language queries for energy monitoring
 """
 
-import requests
-import json
-import time
+import asyncio
+import httpx
+import orjson
+import sys
+from _fixtures import login, make_client
 
-# Configuration
-BASE_URL = "http://localhost:8000"
-ADMIN_EMAIL = "admin@smart-home.com"
-ADMIN_PASSWORD = "admin123"
+# The client timeout leaves room for answers that need an LLM call
+CLIENT_TIMEOUT = httpx.Timeout(60.0)
 
-def login_admin():
-    """Login as admin and get access token"""
-    login_data = {
-        "email": ADMIN_EMAIL,
-        "password": ADMIN_PASSWORD
-    }
-    
-    response = requests.post(f"{BASE_URL}/api/auth/login", json=login_data)
-    if response.status_code == 200:
-        return response.json()["access_token"]
-    else:
-        print(f"Login failed: {response.text}")
-        return None
+CHAT_QUERY_PATH = "/api/chat/query"
 
-def test_chat_query(token, query, description):
-    """Test a chat query and display results"""
-    headers = {"Authorization": f"Bearer {token}"}
-    
+# Example queries and what each one demonstrates
+CHAT_TEST_CASES = [
+    ("Hello", "Greeting"),
+    ("How much energy did my fridge use yesterday?", "Energy usage for specific device"),
+    ("Which of my devices are using the most power?", "Top energy consumers"),
+    ("Show me my energy summary for today", "Energy summary"),
+    ("List my devices", "Device listing"),
+    ("Compare energy usage between my devices", "Device comparison"),
+    ("What's the power consumption of my AC today?", "Specific device energy query"),
+    ("Show me the most efficient devices", "Efficiency comparison"),
+    ("How much energy did I use last month?", "Historical energy summary"),
+    ("Thank you", "Gratitude"),
+    ("What can you help me with?", "Capability inquiry")
+]
+
+# Chat queries in flight at once; each one may call the LLM
+CHAT_CONCURRENCY = 4
+
+async def post_chat_query(client, query):
+    """Send a chat query, returning the response or the exception raised"""
     chat_data = {
         "query": query
     }
     
-    print(f"\n{'='*60}")
-    print(f"Test: {description}")
-    print(f"Query: {query}")
-    print(f"{'='*60}")
-    
     try:
-        response = requests.post(f"{BASE_URL}/api/chat/query", json=chat_data, headers=headers)
-        
-        if response.status_code == 200:
-            result = response.json()
-            print(f"✅ Response:")
-            print(f"Chat ID: {result['chat_id']}")
-            print(f"Answer: {result['answer']}")
-            if result.get('data'):
-                print(f"Data: {json.dumps(result['data'], indent=2)}")
-        else:
-            print(f"❌ Error: {response.status_code}")
-            print(f"Response: {response.text}")
-            
+        return await client.post(CHAT_QUERY_PATH, content=orjson.dumps(chat_data))
     except Exception as e:
-        print(f"❌ Exception: {e}")
+        return e
+
+def print_chat_result(query, description, response):
+    """Display the result of a chat query"""
+    # Collect the block and write it once
+    lines = [
+        "",
+        "=" * 60,
+        f"Test: {description}",
+        f"Query: {query}",
+        "=" * 60,
+    ]
+    
+    if isinstance(response, Exception):
+        lines.append(f"❌ Exception: {response}")
+    elif response.status_code == 200:
+        result = orjson.loads(response.content)
+        lines += [
+            "✅ Response:",
+            f"Chat ID: {result['chat_id']}",
+            f"Answer: {result['answer']}",
+        ]
+        if result.get('data'):
+            lines.append(f"Data: {orjson.dumps(result['data'], option=orjson.OPT_INDENT_2).decode()}")
+    else:
+        lines += [
+            f"❌ Error: {response.status_code}",
+            f"Response: {response.text}",
+        ]
+    
+    sys.stdout.write("\n".join(lines) + "\n")
 
-def test_chat_examples(token):
+async def test_chat_examples(client):
     """Test various chat examples"""
     print("🤖 Testing Conversational AI for Smart Home Energy Monitoring")
     print("This demonstrates natural language queries about energy usage")
     
-    # Test examples
-    test_cases = [
-        ("Hello", "Greeting"),
-        ("How much energy did my fridge use yesterday?", "Energy usage for specific device"),
-        ("Which of my devices are using the most power?", "Top energy consumers"),
-        ("Show me my energy summary for today", "Energy summary"),
-        ("List my devices", "Device listing"),
-        ("Compare energy usage between my devices", "Device comparison"),
-        ("What's the power consumption of my AC today?", "Specific device energy query"),
-        ("Show me the most efficient devices", "Efficiency comparison"),
-        ("How much energy did I use last month?", "Historical energy summary"),
-        ("Thank you", "Gratitude"),
-        ("What can you help me with?", "Capability inquiry")
-    ]
+    # The queries are independent: send a few at a time and print the
+    # results in the original order once they are all back
+    semaphore = asyncio.Semaphore(CHAT_CONCURRENCY)
     
-    for query, description in test_cases:
-        test_chat_query(token, query, description)
-        time.sleep(1)  # Small delay between requests
+    async def run_case(query):
+        async with semaphore:
+            return await post_chat_query(client, query)
+    
+    responses = await asyncio.gather(*[run_case(query) for query, _ in CHAT_TEST_CASES])
+    for (query, description), response in zip(CHAT_TEST_CASES, responses):
+        print_chat_result(query, description, response)
 
-def test_chat_capabilities(token):
+async def test_chat_capabilities(client):
     """Test chat capabilities endpoint"""
-    headers = {"Authorization": f"Bearer {token}"}
-    
     print(f"\n{'='*60}")
     print("Testing Chat Capabilities")
     print(f"{'='*60}")
     
     try:
-        response = requests.get(f"{BASE_URL}/api/chat/capabilities", headers=headers)
+        response = await client.get("/api/chat/capabilities")
         
         if response.status_code == 200:
-            capabilities = response.json()
+            capabilities = orjson.loads(response.content)
             print("✅ Chat Capabilities:")
-            print(json.dumps(capabilities, indent=2))
+            print(orjson.dumps(capabilities, option=orjson.OPT_INDENT_2).decode())
         else:
             print(f"❌ Error: {response.status_code}")
             print(f"Response: {response.text}")
@@ -103,21 +111,19 @@ def test_chat_capabilities(token):
     except Exception as e:
         print(f"❌ Exception: {e}")
 
-def test_chat_examples_endpoint(token):
+async def test_chat_examples_endpoint(client):
     """Test chat examples endpoint"""
-    headers = {"Authorization": f"Bearer {token}"}
-    
     print(f"\n{'='*60}")
     print("Testing Chat Examples Endpoint")
     print(f"{'='*60}")
     
     try:
-        response = requests.get(f"{BASE_URL}/api/chat/examples", headers=headers)
+        response = await client.get("/api/chat/examples")
         
         if response.status_code == 200:
-            examples = response.json()
+            examples = orjson.loads(response.content)
             print("✅ Chat Examples:")
-            print(json.dumps(examples, indent=2))
+            print(orjson.dumps(examples, option=orjson.OPT_INDENT_2).decode())
         else:
             print(f"❌ Error: {response.status_code}")
             print(f"Response: {response.text}")
@@ -125,26 +131,31 @@ def test_chat_examples_endpoint(token):
     except Exception as e:
         print(f"❌ Exception: {e}")
 
-def main():
+async def main():
     print("🚀 Starting Conversational AI Test")
     print("Make sure the API is running and you have some devices and telemetry data")
     
-    # Login
-    token = login_admin()
-    if not token:
-        print("❌ Failed to login. Exiting.")
-        return
-    
-    print("✅ Logged in successfully")
-    
-    # Test chat capabilities
-    test_chat_capabilities(token)
-    
-    # Test chat examples endpoint
-    test_chat_examples_endpoint(token)
-    
-    # Test various chat queries
-    test_chat_examples(token)
+    async with make_client(timeout=CLIENT_TIMEOUT) as client:
+        # Login
+        credentials = await login(client)
+        if not credentials:
+            print("❌ Failed to login. Exiting.")
+            return
+        token, _ = credentials
+        
+        print("✅ Logged in successfully")
+        
+        # Every later request is authenticated, so set the header once
+        client.headers["Authorization"] = f"Bearer {token}"
+        
+        # Test chat capabilities
+        await test_chat_capabilities(client)
+        
+        # Test chat examples endpoint
+        await test_chat_examples_endpoint(client)
+        
+        # Test various chat queries
+        await test_chat_examples(client)
     
     print(f"\n{'='*60}")
     print("🎉 Conversational AI Test Complete!")
@@ -152,4 +163,4 @@ def main():
     print(f"{'='*60}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    asyncio.run(main()) 
\ No newline at end of file